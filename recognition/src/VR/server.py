@@ -5,13 +5,14 @@ from __future__ import print_function
 import socket
 import time
 import json
-import numpy as np
 import tensorflow as tf
 import model_blstm
+import batching
+import inference
+import vocabulary
 import atexit
 import sys
-import select
-from tagProcess import transferS
+from vr_preprocess import transferS
 
 sys.path.append('../../ui_labeling/preprocessing')
 import sphere_fitting
@@ -47,13 +48,16 @@ tf.app.flags.DEFINE_float('decay_rate', 0.99,
                           "decay rate of RMSPropOptimizer")
 tf.app.flags.DEFINE_float('momentum', 0.9,
                           "momentum of RMSPropOptimizer")
-tf.app.flags.DEFINE_float('max_length', 1940,
-                          "pad to same length")
-tf.app.flags.DEFINE_integer('label_pad', 63,
-                            "label pad size")
+tf.app.flags.DEFINE_string('frozen_model', None,
+                           "inference graph written by export_model.py, used instead of restore_path")
+tf.app.flags.DEFINE_boolean('fused_lstm', False,
+                            "the checkpoint was trained with --fused_lstm")
+tf.app.flags.DEFINE_string('reduction', 'none',
+                           "sequence reduction of the training data: none, resample or rdp")
+tf.app.flags.DEFINE_float('reduction_param', 0.0,
+                          "resample spacing or rdp tolerance of the training data")
 
-letter_table = [' ', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z', 'a', 'b', 'c', 'd', 'e', 'f',
-                'g', 'ga', 'h', 'i', 'j', 'k', 'km', 'l', 'm', 'n', 'o', 'p', 'pt', 'q', 'r', 's', 'sc', 'sp', 't', 'u', 'v', 'w', 'x', 'y', 'z', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '<b>']
+vocab = vocabulary.get_vocabulary()
 
 
 class ModelConfig(object):
@@ -76,8 +80,9 @@ class ModelConfig(object):
         self.learning_rate = FLAGS.learning_rate
         self.decay_rate = FLAGS.decay_rate
         self.momentum = FLAGS.momentum
-        self.max_length = FLAGS.max_length
-        self.label_pad = FLAGS.label_pad
+        # inference only, nothing to recompute
+        self.gradient_checkpointing = False
+        self.fused_lstm = FLAGS.fused_lstm
 
     def show(self):
         print("data_dir:", self.data_dir)
@@ -94,8 +99,6 @@ class ModelConfig(object):
         print("learning_rate:", self.learning_rate)
         print("decay_rate:", self.decay_rate)
         print("momentum:", self.momentum)
-        print("max_length:", self.max_length)
-        print("label_pad:", self.label_pad)
 
 
 server_address = ('140.113.210.19',2001)
@@ -153,70 +156,72 @@ def recvall(sock):
 #     data = sock.recv(5000000000)
 #     return str(data)
 
-with tf.get_default_graph().as_default() as graph:
-    config = ModelConfig()
-    config.show()
-    model = model_blstm.HWRModel(config, graph)
-    init = tf.global_variables_initializer()
-    saver = tf.train.Saver()
-    with tf.Session() as sess:
-        sess.run(init)
-        saver.restore(sess, FLAGS.restore_path)
-
-        print("restore")
-        # exit()
-        while True:
-            connection, clientAddr = sock.accept()
-            atexit.register(whenexit)
-            try:
-                print('connection ', clientAddr)
-                while True:
-                    
-                    data = ''.join(recvall(connection))
-                    print(time.time())
-                    # print(type(data))
-                    # print(data[:30])
-                    json_data = json.loads(data)
-                    #print(sphere_fitting.vr_sphere_fitting(json_data))
-                    input_data = transferS(sphere_fitting.vr_sphere_fitting(json_data))
-                    
-                    # time.sleep(5)
-                    # connection.sendall("Done".encode('utf-8'))
-                    # connection.close()
-                    # break
-                    # process data
-
-                    #################
-                    seq_len_list = []
-                    for _, v in enumerate(input_data):
-                        seq_len_list.append(v.shape[0])
-                    seq_len_list = np.array(seq_len_list).astype(np.int32)
-                    padded_input_data = []
-                    for _, v in enumerate(input_data):
-                        residual = FLAGS.max_length - v.shape[0]
-                        padding_array = np.zeros([residual, FLAGS.input_dims])
-                        padded_input_data.append(
-                            np.concatenate([v, padding_array], axis=0))
-                    padded_input_data = np.array(padded_input_data)
-                    num_batch = int(
-                        padded_input_data.shape[0] / config.batch_size)
-                    for i, _ in enumerate(padded_input_data):
-                        start_time = time.time()
-                        predict = model.predict(
-                            sess, padded_input_data[i:i + 1], seq_len_list[i:i + 1])
-                        str_decoded = ''.join(
-                            [letter_table[x] for x in np.asarray(predict.values)])
-                        end_time = time.time()
-                        # print('Original val: %s' % label_data[i])
-                        print('Decoded  val: %s' % str_decoded)
-                        print('Time Cost: %f' % (end_time - start_time))
-                        connection.sendall(str_decoded.encode('utf-8'))
-                        connection.close()
-                        print("inner connection close")
-                    break
-                    # print("ok?")
-                    # print(type(data))
-
-            finally:
-                print("connection close")
+def serve(predict_fn):
+    """
+    Inputs:
+        predict_fn: function, (padded inputs, seq_len) -> decoded SparseTensorValue
+    """
+    # closed by whenexit
+    global connection
+    while True:
+        connection, clientAddr = sock.accept()
+        atexit.register(whenexit)
+        try:
+            print('connection ', clientAddr)
+            while True:
+                
+                data = ''.join(recvall(connection))
+                print(time.time())
+                # print(type(data))
+                # print(data[:30])
+                json_data = json.loads(data)
+                #print(sphere_fitting.vr_sphere_fitting(json_data))
+                input_data = transferS(sphere_fitting.vr_sphere_fitting(json_data),
+                                       (FLAGS.reduction, FLAGS.reduction_param))
+                
+                # time.sleep(5)
+                # connection.sendall("Done".encode('utf-8'))
+                # connection.close()
+                # break
+                # process data
+
+                #################
+                # all trajectories of the request in one batch, padded
+                # only to the longest of them
+                start_time = time.time()
+                padded_input_data, seq_len_list = batching.pad_sequences(
+                    input_data, FLAGS.input_dims)
+                predict = predict_fn(padded_input_data, seq_len_list)
+                str_decoded = vocab.decode_sparse(
+                    predict, padded_input_data.shape[0])
+                end_time = time.time()
+                for text in str_decoded:
+                    print('Decoded  val: %s' % text)
+                print('Time Cost: %f' % (end_time - start_time))
+                connection.sendall('\n'.join(str_decoded).encode('utf-8'))
                 connection.close()
+                print("inner connection close")
+                break
+                # print("ok?")
+                # print(type(data))
+
+        finally:
+            print("connection close")
+            connection.close()
+
+
+if FLAGS.frozen_model is not None:
+    # exported inference graph, nothing to build or restore
+    frozen_model = inference.FrozenModel(FLAGS.frozen_model)
+    print("loaded", FLAGS.frozen_model)
+    serve(frozen_model.predict)
+else:
+    with tf.get_default_graph().as_default() as graph:
+        config = ModelConfig()
+        config.show()
+        model = model_blstm.HWRModel(config, graph, inference_only=True)
+        saver = tf.train.Saver()
+        with tf.Session() as sess:
+            saver.restore(sess, FLAGS.restore_path)
+            print("restore")
+            serve(lambda inputs, seq_len: model.predict(sess, inputs, seq_len))
@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+class BucketBatchSampler(object):
+    """
+    Groups sequences of similar length into batches, so that each batch is
+    padded only to its own longest sequence instead of the corpus maximum.
+    """
+
+    def __init__(self, lengths, batch_size, num_buckets=1, max_tokens=0,
+                 shuffle=True, rng=np.random):
+        """
+        Inputs:
+            lengths: int array, [num_examples], sequence length of each example
+            batch_size: int, maximum number of sequences per batch
+            num_buckets: int, number of equal-count length buckets, 1 -> no bucketing
+            max_tokens: int, maximum padded timesteps (batch size * longest
+                sequence) per batch, 0 -> batches are capped by batch_size only
+            shuffle: bool, shuffle bucket members and batch order every epoch,
+                otherwise members keep ascending length order
+            rng: np.random or a np.random.RandomState
+        """
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.rng = rng
+        num_buckets = max(1, min(num_buckets, self.lengths.shape[0]))
+        # equal-count buckets over the examples sorted by length
+        by_length = np.argsort(self.lengths, kind='mergesort')
+        self.buckets = [bucket for bucket in np.array_split(by_length, num_buckets)
+                        if bucket.shape[0] > 0]
+
+    def split_bucket(self, members):
+        """ cut one bucket into batches, respecting batch_size and max_tokens """
+        batches = []
+        start = 0
+        num_members = members.shape[0]
+        while start < num_members:
+            end = min(start + self.batch_size, num_members)
+            if self.max_tokens > 0:
+                # padded cost of members[start:k] is (k - start) * longest of them
+                running_max = np.maximum.accumulate(self.lengths[members[start:end]])
+                cost = running_max * np.arange(1, end - start + 1)
+                fits = np.flatnonzero(cost <= self.max_tokens)
+                # a single sequence longer than max_tokens still forms a batch
+                end = start + (fits[-1] + 1 if fits.shape[0] > 0 else 1)
+            batches.append(members[start:end])
+            start = end
+        return batches
+
+    def batches(self):
+        """
+        Return:
+            batches: list of int64 arrays, example indexes of each batch of one epoch
+        """
+        batches = []
+        for bucket in self.buckets:
+            members = self.rng.permutation(bucket) if self.shuffle else bucket
+            batches.extend(self.split_bucket(members))
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        return batches
+
+
+def pad_sequences(sequences, input_dims):
+    """
+    Inputs:
+        sequences: list of float arrays, [seq_len, input_dims]
+    Return:
+        inputs: float32 array, [len(sequences), longest sequence, input_dims], zero padded
+        seq_len: int32 array, [len(sequences)]
+    """
+    seq_len = np.array([len(sequence) for sequence in sequences], dtype=np.int32)
+    inputs = np.zeros([len(sequences), np.max(seq_len), input_dims], dtype=np.float32)
+    for row, sequence in enumerate(sequences):
+        inputs[row, :seq_len[row]] = sequence
+    return inputs, seq_len
+
+
+def pad_batch(data_set, indexes):
+    """
+    Inputs:
+        data_set: dataset.RaggedDataset
+        indexes: int array, examples of the batch
+    Return:
+        inputs: float32 array, [len(indexes), longest sequence, input_dims], zero padded
+        seq_len: int32 array, [len(indexes)]
+    """
+    seq_len = np.diff(data_set.offsets)[indexes].astype(np.int32)
+    inputs = np.zeros([len(indexes), np.max(seq_len), data_set.input_dims],
+                      dtype=np.float32)
+    for row, idx in enumerate(indexes):
+        inputs[row, :seq_len[row]] = data_set.sequence(idx)
+    return inputs, seq_len
+
+
+class BatchPadder(object):
+    """
+    Pads batches into one flat float32 buffer that is reused from batch to
+    batch and grows only when a larger batch comes in.
+    The returned arrays are C-contiguous views of the buffer, fed to the
+    session without a copy, valid until the next pad().
+    Serves feed_dict batches (--nouse_input_pipeline) and validation, the
+    input pipeline pads with pad_batch, see InputPipeline.
+    """
+
+    def __init__(self, input_dims):
+        self.input_dims = input_dims
+        self.buffer = np.zeros([0], dtype=np.float32)
+
+    def pad(self, data_set, indexes):
+        """
+        Inputs:
+            data_set: dataset.RaggedDataset
+            indexes: int array, examples of the batch
+        Return:
+            inputs: float32 array, [len(indexes), longest sequence, input_dims], zero padded
+            seq_len: int32 array, [len(indexes)]
+        """
+        seq_len = np.diff(data_set.offsets)[indexes].astype(np.int32)
+        batch_size = len(indexes)
+        max_len = int(np.max(seq_len))
+        size = batch_size * max_len * self.input_dims
+        if size > self.buffer.shape[0]:
+            self.buffer = np.zeros([size], dtype=np.float32)
+        # the first size values, [batch, time, dims] without gaps between rows
+        inputs = self.buffer[:size].reshape([batch_size, max_len, self.input_dims])
+        for row, idx in enumerate(indexes):
+            inputs[row, :seq_len[row]] = data_set.sequence(idx)
+            # clear what the previous batch left behind
+            inputs[row, seq_len[row]:] = 0.0
+        return inputs, seq_len
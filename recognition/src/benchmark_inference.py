@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import numpy as np
+import tensorflow as tf
+import dataset
+import batching
+import inference
+import numpy_inference
+from train_blstm import FLAGS, get_vocab, split_train_valid, eval_batches
+
+tf.app.flags.DEFINE_string('frozen_model', '../export/hwr_model.pb',
+                           "inference graph written by export_model.py")
+tf.app.flags.DEFINE_string('npz_model', '../export/hwr_model.npz',
+                           "weights written by export_model.py --export_npz")
+tf.app.flags.DEFINE_integer('benchmark_batches', 20,
+                            "validation batches to compare on, 0 -> all")
+tf.app.flags.DEFINE_integer('benchmark_repeats', 3,
+                            "timed passes over the batches, the fastest one is reported")
+tf.app.flags.DEFINE_float('logits_atol', 1e-3,
+                          "largest absolute logits difference accepted")
+
+
+def time_passes(predict_fn, batches):
+    """
+    Return:
+        seconds: float, fastest of FLAGS.benchmark_repeats passes over batches
+    """
+    seconds = []
+    for _ in range(FLAGS.benchmark_repeats):
+        start_time = time.time()
+        for input_batch, seq_len_batch in batches:
+            predict_fn(input_batch, seq_len_batch)
+        seconds.append(time.time() - start_time)
+    return min(seconds)
+
+
+def main(_):
+    train_set = dataset.RaggedDataset(FLAGS.data_dir + FLAGS.dataset_name)
+    _, valid_idx = split_train_valid(len(train_set))
+    valid_batches = eval_batches(train_set.seq_len, valid_idx, FLAGS.batch_size)
+    if FLAGS.benchmark_batches > 0:
+        valid_batches = valid_batches[:FLAGS.benchmark_batches]
+    # kept for all passes -> own arrays, not views of a reused BatchPadder buffer
+    batches = [batching.pad_batch(train_set, indexes) for indexes in valid_batches]
+    # one sequence at a time, as the VR server gets them
+    single_batches = [batching.pad_batch(train_set, indexes[:1]) for indexes in valid_batches]
+
+    session_config = tf.ConfigProto(
+        intra_op_parallelism_threads=FLAGS.intra_op_threads,
+        inter_op_parallelism_threads=FLAGS.inter_op_threads)
+    tf_model = inference.FrozenModel(FLAGS.frozen_model, session_config)
+    np_model = numpy_inference.NumpyHWRModel.load(FLAGS.npz_model)
+
+    # same outputs
+    vocab = get_vocab()
+    max_diff = 0.0
+    mismatches = 0
+    num_sequences = 0
+    for input_batch, seq_len_batch in batches:
+        tf_logits = tf_model.logits(input_batch, seq_len_batch)
+        np_logits = np_model.logits(input_batch, seq_len_batch)
+        max_diff = max(max_diff, float(np.max(np.abs(tf_logits - np_logits))))
+        tf_texts = vocab.decode_sparse(
+            tf_model.predict(input_batch, seq_len_batch), len(seq_len_batch))
+        np_texts = vocab.decode_sparse(
+            np_model.predict(input_batch, seq_len_batch), len(seq_len_batch))
+        mismatches += sum(a != b for a, b in zip(tf_texts, np_texts))
+        num_sequences += len(seq_len_batch)
+    print("max logits difference: %g, decoded mismatches: %d of %d sequences" %
+          (max_diff, mismatches, num_sequences))
+
+    # latency, after the warm-up pass above
+    for name, data in [('batch_size %d' % FLAGS.batch_size, batches),
+                       ('batch_size 1', single_batches)]:
+        tf_secs = time_passes(tf_model.predict, data)
+        np_secs = time_passes(np_model.predict, data)
+        print("%s, tensorflow: %f(sec/batch), numpy: %f(sec/batch), speedup: %.2fx" %
+              (name, tf_secs / len(data), np_secs / len(data), tf_secs / np_secs))
+    tf_model.close()
+    if max_diff > FLAGS.logits_atol:
+        raise ValueError("numpy logits differ from tensorflow by %g" % max_diff)
+
+
+if __name__ == "__main__":
+    tf.app.run()
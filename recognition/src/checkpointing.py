@@ -0,0 +1,65 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import tensorflow as tf
+
+
+class AsyncCheckpointer(object):
+    """
+    Copies the variables into shadow variables with one in-graph assign and
+    writes the shadows from a background thread, so training goes on while
+    the checkpoint is on its way to disk. The shadows are saved under the
+    names of the original variables, tf.train.Saver() restores them as usual.
+    """
+
+    def __init__(self, var_list=None, max_to_keep=5):
+        """
+        Inputs:
+            var_list: list of tf.Variable, default all global variables
+            max_to_keep: int, most recent checkpoints kept
+        """
+        if var_list is None:
+            var_list = tf.global_variables()
+        shadows = {}
+        with tf.name_scope('checkpoint_snapshot'):
+            for var in var_list:
+                # local -> not saved by the regular Saver, not trained
+                shadows[var.op.name] = tf.Variable(
+                    tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype),
+                    trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                    name=var.op.name.replace('/', '_'))
+            self.snapshot_op = tf.group(
+                *[tf.assign(shadows[var.op.name], var) for var in var_list])
+        self.saver = tf.train.Saver(var_list=shadows, max_to_keep=max_to_keep)
+        self.thread = None
+
+    def save(self, sess, save_path, global_step, on_saved=None):
+        """
+        Snapshot now, write in the background.
+        Blocks only while the previous checkpoint is still being written.
+
+        Inputs:
+            on_saved: function, (checkpoint path) -> None, called by the
+                background thread once the checkpoint is written
+        """
+        self.wait()
+        sess.run(self.snapshot_op)
+        self.thread = threading.Thread(
+            target=self.write, args=(sess, save_path, global_step, on_saved))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, sess, save_path, global_step, on_saved=None):
+        save_path = self.saver.save(sess, save_path, global_step=global_step,
+                                    write_meta_graph=False)
+        if on_saved is not None:
+            on_saved(save_path)
+        print("Model saved in file: %s" % save_path)
+
+    def wait(self):
+        """ block until the pending checkpoint is written """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tensorflow as tf
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('input_path', None,
+                           "checkpoint to convert eg: ../checkpoints/model.ckpt-5")
+tf.app.flags.DEFINE_string('output_path', None,
+                           "converted checkpoint eg: ../checkpoints_fused/model.ckpt-5")
+tf.app.flags.DEFINE_boolean('to_fused', True,
+                            "LSTMCell -> fused block lstm (--fused_lstm), --noto_fused converts back")
+
+# LSTMCell and LSTMBlockFusedCell share the gate order (i, j, f, o), the
+# kernel layout ([inputs, h] x 4 * hidden), the bias and the peephole
+# weights (w_i_diag, w_f_diag, w_o_diag), only their scope names differ
+CELL_SCOPE = 'lstm_cell/'
+FUSED_CELL_SCOPE = 'lstm_fused_cell/'
+
+
+def convert_name(name, to_fused=True):
+    """
+    Inputs:
+        name: string, checkpoint variable name, optimizer slots included, eg:
+            blstm/cell_0/bidirectional_rnn/fw/lstm_cell/kernel/Adam
+    """
+    if to_fused:
+        return name.replace(CELL_SCOPE, FUSED_CELL_SCOPE)
+    return name.replace(FUSED_CELL_SCOPE, CELL_SCOPE)
+
+
+def convert_checkpoint(input_path, output_path, to_fused=True):
+    reader = tf.train.NewCheckpointReader(input_path)
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with tf.Graph().as_default():
+        variables = []
+        for name in sorted(reader.get_variable_to_shape_map()):
+            new_name = convert_name(name, to_fused)
+            if new_name != name:
+                print("%s -> %s" % (name, new_name))
+            variables.append(tf.Variable(reader.get_tensor(name), name=new_name))
+        saver = tf.train.Saver(variables)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            save_path = saver.save(sess, output_path)
+            print("Converted checkpoint saved in file: %s" % save_path)
+
+
+def main(_):
+    convert_checkpoint(FLAGS.input_path, FLAGS.output_path, FLAGS.to_fused)
+
+
+if __name__ == "__main__":
+    tf.app.run()
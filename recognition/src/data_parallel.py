@@ -0,0 +1,260 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+import model_blstm
+import dataset
+import batching
+import checkpointing
+import training_state
+from train_blstm import FLAGS, ModelConfig, EpochReporter, split_train_valid, eval_batches, batch_getter, \
+    restore_checkpoint, checkpoint_saver, read_results
+
+tf.app.flags.DEFINE_integer('num_workers', 4,
+                            "training processes, each computes the gradients of one shard of every batch")
+tf.app.flags.DEFINE_integer('threads_per_worker', 1,
+                            "intra and inter op threads of each worker session")
+
+# the shared buffers are inherited by the workers, never pickled: under
+# spawn (the macOS default) every worker would get its own copy
+FORK = multiprocessing.get_context('fork')
+
+
+def flatten(arrays):
+    return np.concatenate([np.ravel(array) for array in arrays]).astype(np.float32)
+
+
+def unflatten(flat, shapes):
+    arrays = []
+    start = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        arrays.append(flat[start:start + size].reshape(shape))
+        start += size
+    return arrays
+
+
+class GradientAllReducer(object):
+    """
+    Averages the flat gradients of num_workers processes through shared
+    memory, weighted by the number of examples each one computed them on.
+    Created before the workers are forked.
+    """
+
+    def __init__(self, num_workers, size):
+        """
+        Inputs:
+            num_workers: int, processes taking part in every reduction
+            size: int, number of trainable parameters
+        """
+        self.num_workers = num_workers
+        self.size = size
+        self.barrier = FORK.Barrier(num_workers)
+        # one slot per worker, the views stay valid in the forked workers
+        self.slots = np.frombuffer(FORK.RawArray(
+            'f', num_workers * size), dtype=np.float32).reshape([num_workers, size])
+        self.weights = np.frombuffer(
+            FORK.RawArray('d', num_workers), dtype=np.float64)
+        self.losses = np.frombuffer(
+            FORK.RawArray('d', num_workers), dtype=np.float64)
+
+    def all_reduce(self, rank, grads, weight, losses):
+        """
+        Inputs:
+            rank: int, this worker
+            grads: float32 array, [size], mean gradients of this worker's shard
+            weight: int, examples in the shard, 0 -> grads are ignored
+            losses: float, mean loss of the shard
+        Return:
+            grads: float32 array, [size], mean gradients of the whole batch
+            losses: float, mean loss of the whole batch
+        """
+        np.multiply(grads, weight, out=self.slots[rank])
+        self.weights[rank] = weight
+        self.losses[rank] = losses * weight
+        self.barrier.wait()
+        total = max(np.sum(self.weights), 1.0)
+        mean_grads = np.sum(self.slots, axis=0) / total
+        mean_losses = np.sum(self.losses) / total
+        # nobody overwrites its slot before every worker has read them all
+        self.barrier.wait()
+        return mean_grads.astype(np.float32), mean_losses
+
+    def broadcast(self, rank, values=None):
+        """
+        Inputs:
+            values: float32 array, [size], given by rank 0 only
+        Return:
+            values: float32 array, [size], the values of rank 0
+        """
+        if rank == 0:
+            self.slots[0] = values
+        self.barrier.wait()
+        values = self.slots[0].copy()
+        self.barrier.wait()
+        return values
+
+
+def train_worker(rank, reducer, seed):
+    """
+    One replica, every worker draws the same global batches and trains on
+    its own shard of each, rank 0 validates, writes summaries and saves.
+
+    Inputs:
+        seed: int, --seed or drawn once by the parent, the same in every worker
+    """
+    is_chief = rank == 0
+    config = ModelConfig()
+    # load data, memory-mapped
+    train_set = dataset.RaggedDataset(FLAGS.data_dir + FLAGS.dataset_name)
+    seq_len_list = train_set.seq_len
+    train_idx, valid_idx = split_train_valid(len(train_set))
+    sampler_rng = np.random.RandomState(seed)
+    train_sampler = batching.BucketBatchSampler(
+        seq_len_list[train_idx], config.batch_size,
+        num_buckets=FLAGS.num_buckets, max_tokens=FLAGS.max_tokens,
+        rng=sampler_rng)
+    # same state in every worker, saved with the checkpoints of rank 0
+    state = training_state.TrainingState(train_sampler, sampler_rng)
+    valid_batches = eval_batches(seq_len_list, valid_idx, config.batch_size)
+    vr_valid_set = vr_valid_batches = None
+    if is_chief and FLAGS.if_valid_vr:
+        vr_valid_set = dataset.RaggedDataset(FLAGS.vr_dataset_dir)
+        vr_valid_batches = eval_batches(
+            vr_valid_set.seq_len, np.arange(len(vr_valid_set)), config.batch_size)
+    get_batch = batch_getter(batching.BatchPadder(train_set.input_dims),
+                             train_set, config.label_pad)
+
+    with tf.Graph().as_default() as graph:
+        tf.set_random_seed(seed)
+        model = model_blstm.HWRModel(config, graph, log_summaries=False)
+        shapes = [var.get_shape().as_list() for var in model.trainable_vars]
+        # overwrite the replica with the weights of rank 0
+        weight_phs = [tf.placeholder(dtype=tf.float32, shape=shape) for shape in shapes]
+        sync_op = tf.group(*[tf.assign(var, ph) for var, ph in
+                             zip(model.trainable_vars, weight_phs)])
+        checkpointer = None
+        if is_chief and FLAGS.async_checkpoint:
+            # snapshot variables, written by a background thread
+            checkpointer = checkpointing.AsyncCheckpointer()
+        init = tf.group(tf.global_variables_initializer(),
+                        tf.local_variables_initializer())
+        # same graph as train_blstm.py -> same checkpoint layout
+        saver = tf.train.Saver()
+        if is_chief:
+            # same summaries, validation and checkpoints as train_blstm.py
+            reporter = EpochReporter(
+                graph, get_batch, train_set, valid_batches, vr_valid_set, vr_valid_batches,
+                best_result=read_results(FLAGS.results_file) if FLAGS.resume else None)
+
+        session_config = tf.ConfigProto(
+            intra_op_parallelism_threads=FLAGS.threads_per_worker,
+            inter_op_parallelism_threads=FLAGS.threads_per_worker)
+        with tf.Session(config=session_config) as sess:
+            sess.run(init)
+            # every replica restores, so that optimizer slots and the
+            # training state match too; rank 0 saves nothing before all of
+            # them are through here, they all find the same checkpoint
+            restore_checkpoint(sess, saver, state, FLAGS.restore_path)
+            save_checkpoint = checkpoint_saver(sess, saver, state, checkpointer)
+            no_grads = np.zeros([reducer.size], dtype=np.float32)
+            start_time = time.time()
+            num_steps = 0
+            global_step = sess.run(model.global_steps)
+            # total_epoches counts the epoches of earlier runs too
+            while state.epoch < config.total_epoches:
+                # replicas apply identical updates, re-synced once per epoch
+                weights = None
+                if is_chief:
+                    weights = flatten(sess.run(model.trainable_vars))
+                weights = reducer.broadcast(rank, weights)
+                if not is_chief:
+                    sess.run(sync_op, feed_dict=dict(
+                        zip(weight_phs, unflatten(weights, shapes))))
+
+                loss_sum = 0.0
+                train_num_batch = 0
+                for batch in state.remaining_batches():
+                    shard = np.array_split(train_idx[batch], reducer.num_workers)[rank]
+                    if shard.shape[0] > 0:
+                        grads, losses = model.compute_gradients(
+                            sess, *get_batch(shard))
+                        grads = flatten(grads)
+                    else:
+                        grads, losses = no_grads, 0.0
+                    grads, losses = reducer.all_reduce(
+                        rank, grads, shard.shape[0], losses)
+                    global_step = model.apply_gradients(
+                        sess, unflatten(grads, shapes))
+                    loss_sum += losses
+                    train_num_batch += 1
+                    num_steps += 1
+                    state.step_done()
+                    if is_chief and FLAGS.save_steps > 0 and num_steps % FLAGS.save_steps == 0:
+                        save_checkpoint(global_step)
+                state.epoch_done()
+                if not is_chief:
+                    continue
+
+                # the other workers wait in the next reduction meanwhile
+                reporter.end_epoch(sess, model, state.epoch, global_step, loss_sum,
+                                   train_num_batch, time.time() - start_time, save_checkpoint)
+                start_time = time.time()
+            if checkpointer is not None:
+                # the last checkpoint is complete before the session closes
+                checkpointer.wait()
+
+
+def run_worker(rank, reducer, seed):
+    try:
+        train_worker(rank, reducer, seed)
+    except Exception:
+        # release the workers waiting for this one
+        reducer.barrier.abort()
+        raise
+
+
+def count_parameters():
+    config = ModelConfig()
+    with tf.Graph().as_default() as graph:
+        model = model_blstm.HWRModel(config, graph, log_summaries=False)
+        return sum(int(np.prod(var.get_shape().as_list()))
+                   for var in model.trainable_vars)
+
+
+def main(_):
+    config = ModelConfig()
+    config.show()
+    print("num_workers:", FLAGS.num_workers)
+    # size of the shared gradient buffer, counted in a throwaway process so
+    # that no graph exists in the parent when the workers are forked
+    pool = FORK.Pool(1)
+    size = pool.apply(count_parameters)
+    pool.close()
+    pool.join()
+    reducer = GradientAllReducer(FLAGS.num_workers, size)
+    # the workers draw the same batches only with the same seed
+    seed = FLAGS.seed
+    if seed is None:
+        seed = np.random.randint(2 ** 31 - 1)
+    workers = [FORK.Process(target=run_worker, args=(rank, reducer, seed))
+               for rank in range(FLAGS.num_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed = [rank for rank, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        sys.exit("workers %s failed" % failed)
+
+
+if __name__ == "__main__":
+    if not os.path.exists(FLAGS.checkpoints_dir):
+        os.makedirs(FLAGS.checkpoints_dir)
+    tf.app.run()
@@ -0,0 +1,146 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import numpy as np
+
+import label_codec
+
+# one directory per dataset, every array stored as a plain .npy so that it
+# can be opened with np.load(mmap_mode='r') without reading it into memory
+META_FILE = 'meta.json'
+FEATURES_FILE = 'features.npy'  # float32, [num_steps, input_dims], all sequences back to back
+OFFSETS_FILE = 'offsets.npy'  # int64, [num_examples + 1], sequence i is features[offsets[i]:offsets[i + 1]]
+TEXT_FILE = 'text.npy'  # uint8, utf-8 bytes of all label strings
+TEXT_OFFSETS_FILE = 'text_offsets.npy'  # int64, [num_examples + 1]
+LABELS_FILE = 'labels.npy'  # int32, encoded labels of all examples
+LABEL_OFFSETS_FILE = 'label_offsets.npy'  # int64, [num_examples + 1]
+
+
+def pack(items, dtype):
+    """
+    Inputs:
+        items: list of 1-d or 2-d arrays
+    Return:
+        values: items concatenated along axis 0
+        offsets: int64 array, [len(items) + 1], item i is values[offsets[i]:offsets[i + 1]]
+    """
+    lengths = np.array([len(item) for item in items], dtype=np.int64)
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if len(items) == 0:
+        return np.zeros([0], dtype=dtype), offsets
+    values = np.concatenate([np.asarray(item, dtype=dtype) for item in items], axis=0)
+    return values, offsets
+
+
+def write_meta(path, meta):
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+
+
+def read_meta(path):
+    with open(os.path.join(path, META_FILE), 'r') as f:
+        return json.load(f)
+
+
+def save_dataset(path, sequences, texts, meta=None):
+    """
+    Inputs:
+        path: string, dataset directory, created if missing
+        sequences: list of float32 arrays, [seq_len, input_dims]
+        texts: list of string, label of each sequence
+        meta: dict, extra entries of meta.json
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    features, offsets = pack(sequences, np.float32)
+    text, text_offsets = pack(
+        [np.frombuffer(t.encode('utf-8'), dtype=np.uint8) for t in texts], np.uint8)
+    np.save(os.path.join(path, FEATURES_FILE), features)
+    np.save(os.path.join(path, OFFSETS_FILE), offsets)
+    np.save(os.path.join(path, TEXT_FILE), text)
+    np.save(os.path.join(path, TEXT_OFFSETS_FILE), text_offsets)
+    full_meta = dict(meta or {})
+    full_meta['num_examples'] = len(sequences)
+    full_meta['num_steps'] = int(offsets[-1])
+    if len(sequences) > 0:
+        full_meta['input_dims'] = int(features.shape[1])
+    write_meta(path, full_meta)
+
+
+def save_labels(path, labels, label_offsets, meta=None):
+    """
+    Inputs:
+        path: string, existing dataset directory
+        labels: int32 array, encoded labels of all examples back to back
+        label_offsets: int64 array, [num_examples + 1]
+        meta: dict, entries added to meta.json, eg: the letter table
+    """
+    np.save(os.path.join(path, LABELS_FILE), np.asarray(labels, dtype=np.int32))
+    np.save(os.path.join(path, LABEL_OFFSETS_FILE),
+            np.asarray(label_offsets, dtype=np.int64))
+    full_meta = read_meta(path)
+    full_meta.update(meta or {})
+    write_meta(path, full_meta)
+
+
+class RaggedDataset(object):
+    """
+    Memory-mapped view of a dataset directory, opening it costs O(1)
+    regardless of the corpus size.
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        self.meta = read_meta(path)
+        self.features = np.load(os.path.join(path, FEATURES_FILE), mmap_mode=mmap_mode)
+        # offsets are small, keep them in memory
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        self.text = np.load(os.path.join(path, TEXT_FILE), mmap_mode=mmap_mode)
+        self.text_offsets = np.load(os.path.join(path, TEXT_OFFSETS_FILE))
+        self.labels = None
+        self.label_offsets = None
+        if os.path.exists(os.path.join(path, LABELS_FILE)):
+            self.labels = np.load(os.path.join(path, LABELS_FILE), mmap_mode=mmap_mode)
+            self.label_offsets = np.load(os.path.join(path, LABEL_OFFSETS_FILE))
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    @property
+    def input_dims(self):
+        return self.features.shape[1]
+
+    @property
+    def seq_len(self):
+        """ int32 array, [num_examples] """
+        return np.diff(self.offsets).astype(np.int32)
+
+    @property
+    def label_length(self):
+        """ int32 array, [num_examples] """
+        return np.diff(self.label_offsets).astype(np.int32)
+
+    def sequence(self, idx):
+        return self.features[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def text_of(self, idx):
+        return self.text[self.text_offsets[idx]:self.text_offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def label(self, idx):
+        return self.labels[self.label_offsets[idx]:self.label_offsets[idx + 1]]
+
+    def dense_labels(self, indexes, label_pad, fill=-1):
+        """
+        Inputs:
+            indexes: int array, examples to gather
+            label_pad: int, width of the dense labels, longer labels are cut,
+                None -> the longest label of the batch
+        Return:
+            dense: int32 array, [len(indexes), label_pad], padded by fill
+        """
+        return label_codec.to_dense(self.labels, self.label_offsets, label_pad,
+                                    indexes=indexes, fill=fill)
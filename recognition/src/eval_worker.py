@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+import model_blstm
+import dataset
+import batching
+import evaluation
+from train_blstm import FLAGS, ModelConfig, get_vocab, split_train_valid, eval_batches, batch_getter
+
+tf.app.flags.DEFINE_integer('eval_interval_secs', 60,
+                            "minimum seconds between two evaluations")
+tf.app.flags.DEFINE_integer('eval_timeout_secs', None,
+                            "stop after waiting that long for a new checkpoint, None -> wait forever")
+
+
+def evaluate_checkpoints():
+    """
+    Watches checkpoints_dir and evaluates every new checkpoint on the IAM
+    validation split and optionally the VR split, in its own process, so
+    that train_blstm.py --noinline_validation never waits for validation.
+    """
+    with tf.get_default_graph().as_default() as graph:
+        config = ModelConfig()
+        train_set = dataset.RaggedDataset(FLAGS.data_dir + FLAGS.dataset_name)
+        _, valid_idx = split_train_valid(len(train_set))
+        valid_batches = eval_batches(train_set.seq_len, valid_idx, config.batch_size)
+        if FLAGS.if_valid_vr:
+            vr_valid_set = dataset.RaggedDataset(FLAGS.vr_dataset_dir)
+            vr_valid_batches = eval_batches(
+                vr_valid_set.seq_len, np.arange(len(vr_valid_set)), config.batch_size)
+        get_batch = batch_getter(batching.BatchPadder(train_set.input_dims),
+                                 train_set, config.label_pad)
+
+        model = model_blstm.HWRModel(config, graph, log_summaries=False)
+        saver = tf.train.Saver()
+        # x axis is the global step of the checkpoint
+        valid_summary_writer = tf.summary.FileWriter(FLAGS.log_dir + 'eval_valid')
+        vr_valid_summary_writer = tf.summary.FileWriter(FLAGS.log_dir + 'eval_vr_valid')
+        with tf.Session() as sess:
+            for checkpoint_path in tf.contrib.training.checkpoints_iterator(
+                    FLAGS.checkpoints_dir, min_interval_secs=FLAGS.eval_interval_secs,
+                    timeout=FLAGS.eval_timeout_secs):
+                saver.restore(sess, checkpoint_path)
+                global_step = sess.run(model.global_steps)
+                valid_result = evaluation.evaluate(
+                    sess, model, (get_batch(batch) for batch in valid_batches), get_vocab())
+                valid_summary_writer.add_summary(
+                    evaluation.result_summary(valid_result), global_step=global_step)
+                valid_summary_writer.flush()
+                print("%s, valid mean loss: %f, cer: %f, wer: %f" %
+                      (checkpoint_path, valid_result['loss'],
+                       valid_result['cer'], valid_result['wer']))
+
+                if FLAGS.if_valid_vr:
+                    vr_result = evaluation.evaluate(
+                        sess, model,
+                        (get_batch(batch, vr_valid_set) for batch in vr_valid_batches),
+                        get_vocab())
+                    vr_valid_summary_writer.add_summary(
+                        evaluation.result_summary(vr_result), global_step=global_step)
+                    vr_valid_summary_writer.flush()
+                    print("%s, VR valid mean loss: %f, cer: %f, wer: %f" %
+                          (checkpoint_path, vr_result['loss'],
+                           vr_result['cer'], vr_result['wer']))
+
+
+def main(_):
+    evaluate_checkpoints()
+
+
+if __name__ == "__main__":
+    tf.app.run()
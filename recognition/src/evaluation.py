@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+
+def edit_distance(reference, hypothesis):
+    """
+    Inputs:
+        reference, hypothesis: sequences, eg: strings or lists of words
+    Return:
+        distance: int, insertions + deletions + substitutions
+    """
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+
+def evaluate(sess, model, batches, vocab):
+    """
+    Runs loss, greedy decoding and edit distance together, one session run
+    per batch, over a whole split.
+
+    Inputs:
+        model: model_blstm.HWRModel
+        batches: iterable of (inputs, seq_len, labels) padded batches
+        vocab: vocabulary.Vocabulary
+    Return:
+        result: dict,
+            loss: mean ctc loss per sequence
+            cer: character edits / reference characters over the split,
+                on the decoded strings, a ligature counts as its characters
+            ter: label edits / reference labels over the split, a ligature
+                is one label, from the in-graph edit distance
+            wer: word edits / reference words over the split
+            originals, decoded: list of string, every sequence of the split
+    """
+    loss_sum = 0.0
+    label_edits = 0.0
+    num_labels = 0
+    char_edits = 0
+    num_chars = 0
+    word_edits = 0
+    num_words = 0
+    originals = []
+    decoded = []
+    for inputs, seq_len, labels in batches:
+        sample_losses, decoded_seq, edit_distance = model.evaluate(
+            sess, inputs, seq_len, labels)
+        loss_sum += np.sum(sample_losses)
+        label_edits += np.sum(edit_distance)
+        num_labels += int(np.sum(np.asarray(labels) >= 0))
+        batch_originals = vocab.decode_dense(labels)
+        batch_decoded = vocab.decode_sparse(decoded_seq, len(seq_len))
+        for original, text in zip(batch_originals, batch_decoded):
+            char_edits += edit_distance(original, text)
+            num_chars += len(original)
+            reference = original.split()
+            word_edits += edit_distance(reference, text.split())
+            num_words += len(reference)
+        originals.extend(batch_originals)
+        decoded.extend(batch_decoded)
+    num_examples = len(originals)
+    return {'loss': loss_sum / max(num_examples, 1),
+            'cer': char_edits / max(num_chars, 1),
+            'ter': label_edits / max(num_labels, 1),
+            'wer': word_edits / max(num_words, 1),
+            'originals': originals,
+            'decoded': decoded}
+
+
+def result_summary(result):
+    """
+    Return:
+        summary: tf.Summary of the loss and error rates of an evaluate() result
+    """
+    return tf.Summary(value=[
+        tf.Summary.Value(tag="ephoch_mean_loss", simple_value=result['loss']),
+        tf.Summary.Value(tag="ephoch_cer", simple_value=result['cer']),
+        tf.Summary.Value(tag="ephoch_ter", simple_value=result['ter']),
+        tf.Summary.Value(tag="ephoch_wer", simple_value=result['wer'])])
@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import numpy as np
+import tensorflow as tf
+import model_blstm
+import inference
+from train_blstm import FLAGS, ModelConfig
+
+tf.app.flags.DEFINE_string('export_path', '../export/hwr_model.pb',
+                           "frozen inference graph written by export_model.py")
+tf.app.flags.DEFINE_string('export_npz', None,
+                           "also write the weights as .npz for numpy_inference.py")
+
+# checkpoint names of the weights, see HWRModel
+LSTM_PREFIX = 'blstm/cell_%d/bidirectional_rnn/%s/'
+LSTM_SCOPES = ['lstm_cell/', 'lstm_fused_cell/']
+LSTM_WEIGHTS = ['kernel', 'bias', 'w_i_diag', 'w_f_diag', 'w_o_diag']
+# weightsHidden, biasesHidden, weightsClasses, biasesClasses in creation order
+HEAD_WEIGHTS = [('weights_hidden', 'blstm/Variable'),
+                ('biases_hidden', 'blstm/Variable_1'),
+                ('weights_classes', 'blstm/Variable_2'),
+                ('biases_classes', 'blstm/Variable_3')]
+
+
+def export_model(restore_path, export_path):
+    """
+    Freezes the weights of a training checkpoint into an inference-only
+    graph: inputs, sequence length, logits and greedy decoding.
+    """
+    with tf.Graph().as_default() as graph:
+        config = ModelConfig()
+        model_blstm.HWRModel(config, graph, inference_only=True)
+        # only the model variables, the optimizer slots in the checkpoint are skipped
+        saver = tf.train.Saver()
+        with tf.Session() as sess:
+            saver.restore(sess, restore_path)
+            # constants in place of variables, everything else pruned away
+            frozen_graph_def = tf.graph_util.convert_variables_to_constants(
+                sess, graph.as_graph_def(), inference.OUTPUT_NODES)
+    export_dir = os.path.dirname(export_path)
+    if export_dir and not os.path.exists(export_dir):
+        os.makedirs(export_dir)
+    with tf.gfile.GFile(export_path, 'wb') as f:
+        f.write(frozen_graph_def.SerializeToString())
+    print("%d ops exported to %s" % (len(frozen_graph_def.node), export_path))
+
+
+def export_npz(restore_path, npz_path):
+    """
+    Writes the inference weights of a checkpoint, trained with or without
+    --fused_lstm, as plain arrays: cell_<layer>_<fw|bw>_<weight> and the head.
+    """
+    reader = tf.train.NewCheckpointReader(restore_path)
+    names = reader.get_variable_to_shape_map()
+    weights = {}
+    num_layers = 0
+    while any(LSTM_PREFIX % (num_layers, 'fw') + scope + 'kernel' in names
+              for scope in LSTM_SCOPES):
+        for direction in ['fw', 'bw']:
+            prefix = LSTM_PREFIX % (num_layers, direction)
+            scope = [scope for scope in LSTM_SCOPES if prefix + scope + 'kernel' in names][0]
+            for weight in LSTM_WEIGHTS:
+                weights['cell_%d_%s_%s' % (num_layers, direction, weight)] = \
+                    reader.get_tensor(prefix + scope + weight)
+        num_layers += 1
+    for key, name in HEAD_WEIGHTS:
+        weights[key] = reader.get_tensor(name)
+    weights['num_layers'] = np.array(num_layers)
+    np.savez(npz_path, **weights)
+    print("%d layers exported to %s" % (num_layers, npz_path))
+
+
+def main(_):
+    restore_path = FLAGS.restore_path or tf.train.latest_checkpoint(FLAGS.checkpoints_dir)
+    export_model(restore_path, FLAGS.export_path)
+    if FLAGS.export_npz is not None:
+        export_npz(restore_path, FLAGS.export_npz)
+
+
+if __name__ == "__main__":
+    tf.app.run()
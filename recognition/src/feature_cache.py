@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+import features
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class FeatureCache(object):
+    """
+    Per source file cache of computed arrays, keyed by the sha1 of the file
+    content and the feature pipeline version, so a rebuild only recomputes
+    new or changed recordings.
+    """
+
+    def __init__(self, cache_dir, version=features.FEATURE_VERSION):
+        self.cache_dir = cache_dir
+        self.version = str(version)
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def file_key(self, path):
+        sha1 = hashlib.sha1(self.version.encode('utf-8'))
+        sha1.update(b'\0')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def load(self, key):
+        """
+        Return:
+            arrays: dict of name -> array, None if key is not cached
+        """
+        entry_path = self.entry_path(key)
+        if not os.path.exists(entry_path):
+            return None
+        with np.load(entry_path) as entry:
+            return {name: entry[name] for name in entry.files}
+
+    def save(self, key, arrays):
+        entry_path = self.entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+        if not os.path.exists(entry_dir):
+            try:
+                os.makedirs(entry_dir)
+            except OSError:  # created by another worker
+                pass
+        # write then rename, concurrent workers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=entry_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp_path, entry_path)
+
+    def lookup(self, path, compute):
+        """
+        Inputs:
+            path: string, source file
+            compute: function, path -> dict of name -> array, called on a miss
+        Return:
+            arrays: dict of name -> array
+        """
+        key = self.file_key(path)
+        arrays = self.load(key)
+        if arrays is not None:
+            self.hits += 1
+            return arrays
+        self.misses += 1
+        arrays = compute(path)
+        self.save(key, arrays)
+        return arrays
+
+    def show(self):
+        print("feature cache %s: %d hits, %d misses" %
+              (self.cache_dir, self.hits, self.misses))
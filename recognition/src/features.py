@@ -0,0 +1,117 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+# bump whenever the computed features change, invalidates feature caches
+FEATURE_VERSION = 1
+# column order of the 10 features per point
+FEATURE_NAMES = ('x_speed', 'y_speed', 'x_cor', 'y_cor', 'curvature_sin', 'curvature_cos',
+                 'writing_sin', 'writing_cos', 'pen_up', 'time')
+NUM_FEATURES = len(FEATURE_NAMES)
+# replaces zero time differences to prevent divide by 0
+MIN_TIME_DIFF = 0.001
+
+
+def offsets_from_tags(tags):
+    """
+    Inputs:
+        tags: 1-d array, stroke tag of each point, points of one stroke must be contiguous
+    Return:
+        offsets: int64 array, [num_strokes + 1], stroke i is points[offsets[i]:offsets[i + 1]]
+    """
+    tags = np.asarray(tags)
+    change = np.flatnonzero(tags[1:] != tags[:-1]) + 1
+    return np.concatenate([[0], change, [tags.shape[0]]]).astype(np.int64)
+
+
+def group_by_tag(tags):
+    """
+    Inputs:
+        tags: 1-d array, stroke tag of each point
+    Return:
+        order: int64 array, permutation making the points of each stroke contiguous,
+            strokes sorted by tag and points kept in recording order
+        offsets: int64 array, stroke offsets into the permuted points
+    """
+    tags = np.asarray(tags)
+    order = np.argsort(tags, kind='mergesort')
+    return order.astype(np.int64), offsets_from_tags(tags[order])
+
+
+def compute_features(x, y, time_stamp, offsets):
+    """
+    Compute the 10 features of a whole trajectory at once.
+
+    Inputs:
+        x, y: 1-d arrays, normalized coordinates of all points
+        time_stamp: 1-d array, time of each point relative to the first point
+        offsets: 1-d int array, [num_strokes + 1], stroke offsets into the points
+    Return:
+        features: float32 array, [num_points, NUM_FEATURES], columns in FEATURE_NAMES order
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    time_stamp = np.asarray(time_stamp, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_points = x.shape[0]
+    features = np.empty([num_points, NUM_FEATURES], dtype=np.float32)
+    if num_points == 0:
+        return features
+
+    # first and last point of every non-empty stroke
+    lengths = np.diff(offsets)
+    starts = offsets[:-1][lengths > 0]
+    ends = offsets[1:][lengths > 0] - 1
+    is_start = np.zeros(num_points, dtype=bool)
+    is_start[starts] = True
+    is_end = np.zeros(num_points, dtype=bool)
+    is_end[ends] = True
+
+    # speed, 0 at the first point of each stroke
+    x_diff = np.zeros(num_points)
+    y_diff = np.zeros(num_points)
+    time_diff = np.ones(num_points)
+    x_diff[1:] = x[1:] - x[:-1]
+    y_diff[1:] = y[1:] - y[:-1]
+    time_diff[1:] = time_stamp[1:] - time_stamp[:-1]
+    time_diff[time_diff == 0] = MIN_TIME_DIFF
+    x_diff[is_start] = 0.0
+    y_diff[is_start] = 0.0
+    x_sp = x_diff / time_diff
+    y_sp = y_diff / time_diff
+
+    # curvature, angle between (prev - now) and (next - now), 0 at stroke ends
+    angle = np.zeros(num_points)
+    inner = np.flatnonzero(~(is_start | is_end))
+    if inner.shape[0] > 0:
+        v0_x = x[inner - 1] - x[inner]
+        v0_y = y[inner - 1] - y[inner]
+        v1_x = x[inner + 1] - x[inner]
+        v1_y = y[inner + 1] - y[inner]
+        angle[inner] = np.arctan2(v0_x * v1_y - v0_y * v1_x,
+                                  v0_x * v1_x + v0_y * v1_y)
+
+    # writing direction, (0, 1) when not moving
+    slope = np.hypot(x_sp, y_sp)
+    moving = slope != 0
+    safe_slope = np.where(moving, slope, 1.0)
+    writing_sin = np.where(moving, y_sp / safe_slope, 0.0)
+    writing_cos = np.where(moving, x_sp / safe_slope, 1.0)
+
+    # pen up and down, 0 at the last point of each stroke
+    pen_up = np.ones(num_points)
+    pen_up[is_end] = 0.0
+
+    features[:, 0] = x_sp
+    features[:, 1] = y_sp
+    features[:, 2] = x
+    features[:, 3] = y
+    features[:, 4] = np.sin(angle)
+    features[:, 5] = np.cos(angle)
+    features[:, 6] = writing_sin
+    features[:, 7] = writing_cos
+    features[:, 8] = pen_up
+    features[:, 9] = time_stamp
+    return features
@@ -0,0 +1,61 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+# node names of HWRModel(inference_only=True), see export_model.py
+INPUT_NODE = 'input_data'
+SEQ_LEN_NODE = 'sequence_lenth'
+LOGITS_NODE = 'logits'
+DECODED_NODES = ['decoded_indices', 'decoded_values', 'decoded_shape']
+OUTPUT_NODES = [LOGITS_NODE] + DECODED_NODES
+
+
+class FrozenModel(object):
+    """
+    Serves an exported inference graph, no checkpoint restore and no
+    training ops to build.
+    """
+
+    def __init__(self, model_path, session_config=None):
+        """
+        Inputs:
+            model_path: string, .pb written by export_model.py
+            session_config: tf.ConfigProto, eg: thread caps
+        """
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(model_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.input_ph = self.graph.get_tensor_by_name(INPUT_NODE + ':0')
+        self.seq_len_ph = self.graph.get_tensor_by_name(SEQ_LEN_NODE + ':0')
+        self.logits_op = self.graph.get_tensor_by_name(LOGITS_NODE + ':0')
+        self.decoded_ops = [self.graph.get_tensor_by_name(name + ':0')
+                            for name in DECODED_NODES]
+        self.sess = tf.Session(graph=self.graph, config=session_config)
+
+    def predict(self, inputs, seq_len):
+        """
+        Inputs:
+            inputs: float32 array, [batch_size, padded length, input_dims]
+            seq_len: int32 array, [batch_size]
+        Return:
+            decoded_seq: SparseTensorValue, as HWRModel.predict, for Vocabulary.decode_sparse
+        """
+        indices, values, dense_shape = self.sess.run(
+            self.decoded_ops, feed_dict={self.input_ph: inputs, self.seq_len_ph: seq_len})
+        return tf.SparseTensorValue(indices, values, dense_shape)
+
+    def logits(self, inputs, seq_len):
+        """
+        Return:
+            logits: float32 array, [padded length, batch_size, num_classes], time major
+        """
+        return self.sess.run(
+            self.logits_op, feed_dict={self.input_ph: inputs, self.seq_len_ph: seq_len})
+
+    def close(self):
+        self.sess.close()
@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import numpy as np
+import tensorflow as tf
+
+import batching
+
+
+class InputPipeline(object):
+    """
+    tf.data pipeline over a memory-mapped dataset: batches are padded in
+    background threads and prefetched while the model runs, the model reads
+    them straight from the iterator (see HWRModel inputs).
+    """
+
+    def __init__(self, data_set, batches_fn, label_pad, num_threads=2, prefetch_batches=2):
+        """
+        Inputs:
+            data_set: dataset.RaggedDataset
+            batches_fn: function, () -> list of int arrays, example indexes of
+                each batch of one epoch, eg: from BucketBatchSampler
+            label_pad: int, width of the dense labels, None -> per batch
+            num_threads: int, batches padded in parallel
+            prefetch_batches: int, batches prepared ahead of the model
+        """
+        self.data_set = data_set
+        self.label_pad = label_pad
+        # time each batch of the epoch was ready, by its number in the epoch,
+        # written by the pipeline threads
+        self.ready_times = {}
+        input_dims = data_set.input_dims
+
+        def batch_generator():
+            # map keeps this order, the n-th batch yielded is the n-th read
+            for number, indexes in enumerate(batches_fn()):
+                yield number, np.asarray(indexes, dtype=np.int64)
+
+        def load_batch(number, indexes):
+            # fresh arrays, not a reused BatchPadder buffer: py_func may hand
+            # the array memory to the tensor without a copy, and prefetched
+            # batches are still queued while the next ones are padded
+            input_batch, seq_len_batch = batching.pad_batch(data_set, indexes)
+            dense_batch = data_set.dense_labels(indexes, label_pad)
+            self.ready_times[int(number)] = time.time()
+            return input_batch, seq_len_batch, dense_batch
+
+        def tf_load_batch(number, indexes):
+            input_batch, seq_len_batch, dense_batch = tf.py_func(
+                load_batch, [number, indexes], [tf.float32, tf.int32, tf.int32], stateful=False)
+            input_batch.set_shape([None, None, input_dims])
+            seq_len_batch.set_shape([None])
+            dense_batch.set_shape([None, None])
+            return input_batch, seq_len_batch, dense_batch
+
+        with tf.name_scope('input_pipeline'):
+            pipeline = tf.data.Dataset.from_generator(
+                batch_generator, (tf.int64, tf.int64),
+                (tf.TensorShape([]), tf.TensorShape([None])))
+            pipeline = pipeline.map(tf_load_batch, num_parallel_calls=num_threads)
+            pipeline = pipeline.prefetch(prefetch_batches)
+            self.iterator = pipeline.make_initializable_iterator()
+        # run once per epoch, the iterator raises OutOfRangeError at the end
+        self.initializer = self.iterator.initializer
+
+    def wait_time(self, number, step_start):
+        """
+        Inputs:
+            number: int, batches of the epoch read before this one
+            step_start: float, time.time() before the step reading it ran
+        Return:
+            wait_time: float, sec the step waited for the batch, 0.0 when it
+                was prefetched in time
+        """
+        ready_time = self.ready_times.pop(number, step_start)
+        return max(0.0, ready_time - step_start)
+
+    def get_next(self):
+        """
+        Return:
+            (input_batch, seq_len_batch, dense_batch) tensors of the next batch
+        """
+        return self.iterator.get_next()
@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import csv
+import numpy as np
+import tensorflow as tf
+
+CSV_FIELDS = ['global_step', 'num_samples', 'num_timesteps', 'data_time', 'run_time',
+              'summary_time', 'step_time', 'samples_per_sec', 'timesteps_per_sec']
+
+
+class ThroughputLogger(object):
+    """
+    Per step timing of training, every step goes to a CSV file, averages over
+    summary_freq steps go to TensorBoard.
+    data_time is the part of the step spent waiting for the batch and
+    run_time the rest of the session run, so data_time + run_time +
+    summary_time is about step_time with fed batches and the input pipeline
+    alike. data_time >= run_time on average -> input-bound, otherwise
+    compute-bound; with the input pipeline any lasting data_time above 0
+    already means its threads do not keep up.
+    """
+
+    def __init__(self, log_dir, csv_path, summary_freq=100):
+        """
+        Inputs:
+            log_dir: string, summaries are written to log_dir + 'throughput'
+            csv_path: string, rows are appended, the header is written once
+            summary_freq: int, steps averaged per TensorBoard point
+        """
+        self.summary_freq = max(1, summary_freq)
+        self.summary_writer = tf.summary.FileWriter(log_dir + 'throughput')
+        new_file = not os.path.exists(csv_path)
+        self.csv_file = open(csv_path, 'a')
+        self.csv_writer = csv.writer(self.csv_file)
+        if new_file:
+            self.csv_writer.writerow(CSV_FIELDS)
+        self.window = []
+
+    def record(self, global_step, num_samples, num_timesteps, data_time, run_time,
+               summary_time, step_time, with_summary):
+        """
+        Inputs:
+            data_time: float, sec preparing the batch (fed) or waiting for
+                the pipeline to have it ready
+            run_time: float, sec of the session run without data_time, with
+                merged_op if with_summary
+            summary_time: float, sec writing the summary
+            step_time: float, wall sec of the whole step
+            with_summary: bool, merged_op was run in this step
+        """
+        step_time = max(step_time, 1e-9)
+        row = [global_step, num_samples, num_timesteps, data_time, run_time,
+               summary_time, step_time, num_samples / step_time, num_timesteps / step_time]
+        self.csv_writer.writerow(row)
+        self.window.append((row, with_summary))
+        if len(self.window) >= self.summary_freq:
+            self.write_summary(global_step)
+
+    def write_summary(self, global_step):
+        rows = np.array([row for row, _ in self.window], dtype=np.float64)
+        with_summary = np.array([flag for _, flag in self.window])
+        num_samples, num_timesteps = rows[:, 1].sum(), rows[:, 2].sum()
+        data_time, run_time, summary_time, step_time = (
+            rows[:, 3], rows[:, 4], rows[:, 5], rows[:, 6])
+        values = [
+            tf.Summary.Value(tag="data_time", simple_value=data_time.mean()),
+            tf.Summary.Value(tag="run_time", simple_value=run_time.mean()),
+            tf.Summary.Value(tag="samples_per_sec", simple_value=num_samples / step_time.sum()),
+            tf.Summary.Value(tag="timesteps_per_sec", simple_value=num_timesteps / step_time.sum())]
+        if with_summary.any() and not with_summary.all():
+            # extra run time of the steps running merged_op, plus writing it
+            overhead = (run_time[with_summary].mean() - run_time[~with_summary].mean()
+                        + summary_time[with_summary].mean())
+            values.append(tf.Summary.Value(tag="summary_overhead", simple_value=overhead))
+        self.summary_writer.add_summary(tf.Summary(value=values), global_step=global_step)
+        self.summary_writer.flush()
+        self.csv_file.flush()
+        self.window = []
+
+    def close(self):
+        if self.window:
+            self.write_summary(int(self.window[-1][0][0]))
+        self.summary_writer.close()
+        self.csv_file.close()
@@ -0,0 +1,106 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+# last entry of the letter tables, the CTC blank, never matched in text
+BLANK_TOKEN = '<b>'
+
+
+class LabelCodec(object):
+    """
+    Encodes label strings into letter table indexes with a dict lookup,
+    ligatures (eg: 'ga', 'sp') are matched greedily, longest token first.
+    """
+
+    def __init__(self, table, lowercase=False):
+        """
+        Inputs:
+            table: list of string, letter table, index i encodes table[i]
+            lowercase: bool, lowercase the labels before encoding
+        """
+        self.table = list(table)
+        self.lowercase = lowercase
+        self.token_index = {token: idx for idx, token in enumerate(self.table)
+                            if token != BLANK_TOKEN}
+        self.max_token_length = max(len(token) for token in self.token_index)
+
+    def tokenize(self, text):
+        """
+        Return:
+            codes: list of int, unknown characters are skipped
+        """
+        if self.lowercase:
+            text = text.lower()
+        codes = []
+        pos = 0
+        text_length = len(text)
+        while pos < text_length:
+            for token_length in range(min(self.max_token_length, text_length - pos), 0, -1):
+                code = self.token_index.get(text[pos:pos + token_length])
+                if code is not None:
+                    codes.append(code)
+                    pos += token_length
+                    break
+            else:
+                pos += 1
+        return codes
+
+    def encode(self, text):
+        """
+        Return:
+            codes: int32 array, [num_tokens]
+        """
+        return np.asarray(self.tokenize(text), dtype=np.int32)
+
+    def encode_all(self, texts):
+        """
+        Encode the whole label set in one pass.
+
+        Return:
+            values: int32 array, all codes back to back
+            offsets: int64 array, [len(texts) + 1], label i is values[offsets[i]:offsets[i + 1]]
+        """
+        values = []
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        for idx, text in enumerate(texts):
+            values.extend(self.tokenize(text))
+            offsets[idx + 1] = len(values)
+        return np.asarray(values, dtype=np.int32), offsets
+
+    def unknown_chars(self, text):
+        """ characters of text that no token covers """
+        if self.lowercase:
+            text = text.lower()
+        return sorted(set(char for char in text if char not in self.token_index))
+
+
+def to_dense(values, offsets, label_pad, indexes=None, fill=-1):
+    """
+    Dense view of CSR-packed labels for the model.
+
+    Inputs:
+        values, offsets: CSR-packed labels, see LabelCodec.encode_all
+        label_pad: int, width of the dense labels, longer labels are cut,
+            None -> the longest gathered label
+        indexes: int array, labels to gather, default all
+        fill: int, padding value, -1 -> sparse slots in dense presentation
+    Return:
+        dense: int32 array, [num_labels, label_pad]
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if indexes is None:
+        indexes = np.arange(offsets.shape[0] - 1)
+    indexes = np.asarray(indexes, dtype=np.int64)
+    starts = offsets[indexes]
+    lengths = offsets[indexes + 1] - starts
+    if label_pad is None:
+        label_pad = int(np.max(lengths)) if lengths.shape[0] > 0 else 0
+    lengths = np.minimum(lengths, label_pad)
+    dense = np.full([indexes.shape[0], label_pad], fill, dtype=np.int32)
+    rows = np.repeat(np.arange(indexes.shape[0]), lengths)
+    row_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    cols = np.arange(rows.shape[0]) - row_starts[rows]
+    dense[rows, cols] = values[starts[rows] + cols]
+    return dense
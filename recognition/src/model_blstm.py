@@ -2,6 +2,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import time
 import numpy as np
 import tensorflow as tf
 from tensorflow.contrib import rnn
@@ -12,7 +13,16 @@ class HWRModel(object):
     HandWriting Recognition Model
     """
 
-    def __init__(self, config, graph):
+    def __init__(self, config, graph, inputs=None, log_summaries=True,
+                 inference_only=False):
+        """
+        Inputs:
+            inputs: (input, seq_len, label) tensors, eg: InputPipeline.get_next(),
+                read when nothing is fed, None -> the placeholders must be fed
+            log_summaries: bool, False -> no summary writer, step() skips the summaries
+            inference_only: bool, only inputs, sequence length, logits and
+                greedy decoding, no labels, loss, optimizer or summaries
+        """
         self.data_dir = config.data_dir
         self.checkpoints_dir = config.checkpoints_dir
         self.log_dir = config.log_dir
@@ -24,21 +34,21 @@ class HWRModel(object):
         self.learning_rate = config.learning_rate
         self.decay_rate = config.decay_rate
         self.momentum = config.momentum
-        self.max_length = config.max_length
-        self.label_pad = config.label_pad
+        self.gradient_checkpointing = config.gradient_checkpointing
+        self.fused_lstm = config.fused_lstm
 
-        self.global_steps = tf.train.get_or_create_global_step(graph=graph)
-        self.input_ph = tf.placeholder(dtype=tf.float32, shape=[
-            None, None, self.input_dims], name='input_data')
-        self.seq_len_ph = tf.placeholder(dtype=tf.int32, shape=[
-            None], name='sequence_lenth')
-        self.label_ph = tf.placeholder(dtype=tf.int32, shape=[
-            self.batch_size, self.label_pad], name='label_data')
-        # transform label from dense to sparse form
-        # -1 -> sparse slots in dense presentation
-        indices = tf.where(tf.not_equal(self.label_ph, -1))
-        self.label_sparse = tf.SparseTensor(indices, tf.gather_nd(
-            self.label_ph, indices), self.label_ph.shape)
+        if inputs is None:
+            self.input_ph = tf.placeholder(dtype=tf.float32, shape=[
+                None, None, self.input_dims], name='input_data')
+            self.seq_len_ph = tf.placeholder(dtype=tf.int32, shape=[
+                None], name='sequence_lenth')
+        else:
+            # feeding still overrides the iterator, eg: for validation
+            input_batch, seq_len_batch, _ = inputs
+            self.input_ph = tf.placeholder_with_default(input_batch, shape=[
+                None, None, self.input_dims], name='input_data')
+            self.seq_len_ph = tf.placeholder_with_default(seq_len_batch, shape=[
+                None], name='sequence_lenth')
 
         # inference
         def lstm_cell():
@@ -46,45 +56,127 @@ class HWRModel(object):
                                 forget_bias=1.0, state_is_tuple=True,
                                 activation=tf.tanh, reuse=tf.get_variable_scope().reuse)
 
+        def blstm_layer(layer_inputs):
+            # one layer of stack_bidirectional_dynamic_rnn, same variable names
+            outputs, _ = tf.nn.bidirectional_dynamic_rnn(
+                lstm_cell(), lstm_cell(), layer_inputs,
+                sequence_length=self.seq_len_ph, dtype=tf.float32)
+            return tf.concat(outputs, 2)
+
+        def fused_lstm(layer_inputs):
+            # whole sequence in one kernel, gates i, j, f, o and peepholes as LSTMCell
+            cell = rnn.LSTMBlockFusedCell(self.hidden_size, forget_bias=1.0,
+                                          use_peephole=True)
+            outputs, _ = cell(layer_inputs, dtype=tf.float32,
+                              sequence_length=self.seq_len_ph)
+            return outputs
+
+        def fused_blstm_layer(layer_inputs):
+            # time major [T, B, D] in and out, same scopes as blstm_layer
+            with tf.variable_scope('bidirectional_rnn'):
+                with tf.variable_scope('fw'):
+                    outputs_fw = fused_lstm(layer_inputs)
+                with tf.variable_scope('bw'):
+                    # reversed within each sequence, padding stays at the end
+                    outputs_bw = tf.reverse_sequence(fused_lstm(
+                        tf.reverse_sequence(layer_inputs, self.seq_len_ph,
+                                            seq_dim=0, batch_dim=1)),
+                        self.seq_len_ph, seq_dim=0, batch_dim=1)
+            return tf.concat([outputs_fw, outputs_bw], 2)
+
         with tf.variable_scope('blstm') as scope:
-            # dynamic method
-            fwbw, _, _ = rnn.stack_bidirectional_dynamic_rnn(
-                cells_fw=[lstm_cell() for _ in range(self.num_layers)],
-                cells_bw=[lstm_cell() for _ in range(self.num_layers)],
-                inputs=self.input_ph,
-                dtype=tf.float32,
-                initial_states_fw=None,
-                initial_states_bw=None,
-                sequence_length=self.seq_len_ph,
-                parallel_iterations=None,
-                scope=scope
-            )
+            if self.fused_lstm:
+                # time major through all layers, the logits are time major too
+                fwbw = tf.transpose(self.input_ph, [1, 0, 2])
+                layer = fused_blstm_layer
+                if self.gradient_checkpointing:
+                    layer = tf.contrib.layers.recompute_grad(fused_blstm_layer)
+                for i in range(self.num_layers):
+                    # recompute_grad needs resource variables created inside it,
+                    # the variable names and checkpoints stay the same
+                    with tf.variable_scope('cell_%d' % i,
+                                           use_resource=self.gradient_checkpointing):
+                        fwbw = layer(fwbw)
+            elif self.gradient_checkpointing:
+                # only the layer boundaries are kept for backprop, the
+                # activations inside each layer are recomputed layer by layer
+                fwbw = self.input_ph
+                for i in range(self.num_layers):
+                    # recompute_grad needs resource variables created inside it,
+                    # the variable names and checkpoints stay the same
+                    with tf.variable_scope('cell_%d' % i, use_resource=True):
+                        fwbw = tf.contrib.layers.recompute_grad(blstm_layer)(fwbw)
+            else:
+                # dynamic method
+                fwbw, _, _ = rnn.stack_bidirectional_dynamic_rnn(
+                    cells_fw=[lstm_cell() for _ in range(self.num_layers)],
+                    cells_bw=[lstm_cell() for _ in range(self.num_layers)],
+                    inputs=self.input_ph,
+                    dtype=tf.float32,
+                    initial_states_fw=None,
+                    initial_states_bw=None,
+                    sequence_length=self.seq_len_ph,
+                    parallel_iterations=None,
+                    scope=scope
+                )
             # merge forward and backward output by weighted combination
-            fwbw_rh = tf.reshape(
-                fwbw, [-1, self.max_length, 2, self.hidden_size])
-            print("stack_bidirectional_dynamic_rnn:", fwbw_rh)
+            # batch size and padded length are taken at runtime
+            fwbw_shape = tf.shape(fwbw)
             weightsHidden = tf.Variable(tf.truncated_normal([2, self.hidden_size],
                                                             stddev=0.1))
             biasesHidden = tf.Variable(tf.zeros([self.hidden_size]))
-            # transposed to time_major
-            fwbw_rh_tp_unst = tf.unstack(fwbw_rh, axis=1)
-            print(fwbw_rh_tp_unst[0])
-            fb_sum = [tf.reduce_sum(tf.multiply(
-                t, weightsHidden), axis=1) + biasesHidden for t in fwbw_rh_tp_unst]
-            print(fb_sum[0])
             weightsClasses = tf.Variable(tf.truncated_normal([self.hidden_size,  self.num_classes],
                                                              stddev=0.1))
             biasesClasses = tf.Variable(tf.zeros([self.num_classes]))
-            fb_out = [tf.matmul(t, weightsClasses) +
-                      biasesClasses for t in fb_sum]
-            fb_out_st = tf.stack(fb_out, axis=0)
-            print(fb_out_st)
+            # the weighted fw/bw merge is linear, fold it into the class projection:
+            # out = sum_d fwbw[d] * weightsHidden[d] @ weightsClasses + biasesHidden @ weightsClasses + biasesClasses
+            weightsMerged = tf.reshape(
+                tf.expand_dims(weightsHidden, 2) * tf.expand_dims(weightsClasses, 0),
+                [2 * self.hidden_size, self.num_classes])
+            biasesMerged = tf.matmul(tf.expand_dims(biasesHidden, 0),
+                                     weightsClasses)[0] + biasesClasses
+            # one matmul over all timesteps of the batch
+            fb_out = tf.matmul(tf.reshape(fwbw, [-1, 2 * self.hidden_size]),
+                               weightsMerged) + biasesMerged
+            fb_out_st = tf.reshape(
+                fb_out, [fwbw_shape[0], fwbw_shape[1], self.num_classes])
+            if not self.fused_lstm:
+                # transposed to time_major
+                fb_out_st = tf.transpose(fb_out_st, [1, 0, 2])
 
         # time_major
-        self.logits_op = fb_out_st
-        print(self.logits_op)
+        self.logits_op = tf.identity(fb_out_st, name='logits')
+        with tf.name_scope('decoder'):
+            decoded, _ = tf.nn.ctc_greedy_decoder(
+                inputs=self.logits_op,
+                sequence_length=self.seq_len_ph,
+                merge_repeated=True)
+        self.decoded_op = decoded
+        # named outputs of the exported inference graph
+        tf.identity(decoded[0].indices, name='decoded_indices')
+        tf.identity(decoded[0].values, name='decoded_values')
+        tf.identity(decoded[0].dense_shape, name='decoded_shape')
+        if inference_only:
+            return
+
+        self.global_steps = tf.train.get_or_create_global_step(graph=graph)
+        if inputs is None:
+            self.label_ph = tf.placeholder(dtype=tf.int32, shape=[
+                None, None], name='label_data')
+        else:
+            self.label_ph = tf.placeholder_with_default(inputs[2], shape=[
+                None, None], name='label_data')
+        # size of the batch actually run, also when read from the input pipeline
+        self.num_samples_op = tf.shape(self.seq_len_ph)[0]
+        self.num_timesteps_op = tf.reduce_sum(self.seq_len_ph)
+        # transform label from dense to sparse form
+        # -1 -> sparse slots in dense presentation
+        indices = tf.where(tf.not_equal(self.label_ph, -1))
+        self.label_sparse = tf.SparseTensor(indices, tf.gather_nd(
+            self.label_ph, indices), tf.shape(self.label_ph, out_type=tf.int64))
+
         with tf.name_scope('ctc_loss'):
-            ctc_loss = tf.nn.ctc_loss(
+            sample_losses = tf.nn.ctc_loss(
                 labels=self.label_sparse,
                 inputs=self.logits_op,
                 sequence_length=self.seq_len_ph,
@@ -92,32 +184,38 @@ class HWRModel(object):
                 ctc_merge_repeated=True,
                 time_major=True
             )
-            ctc_loss = tf.reduce_mean(ctc_loss)
+            ctc_loss = tf.reduce_mean(sample_losses)
             tf.summary.scalar('ctc_loss', ctc_loss)
         self.losses_op = ctc_loss
-        print(self.losses_op)
+        self.sample_losses_op = sample_losses
 
-        self.train_op = tf.train.AdamOptimizer(
-            self.learning_rate).minimize(self.losses_op,
-                                         global_step=self.global_steps)
-
-        with tf.name_scope('decoder'):
-            decoded, _ = tf.nn.ctc_greedy_decoder(
-                inputs=self.logits_op,
-                sequence_length=self.seq_len_ph,
-                merge_repeated=True)
-            print(decoded[0])
-        self.decoded_op = decoded
+        optimizer = tf.train.AdamOptimizer(self.learning_rate)
+        grads_and_vars = optimizer.compute_gradients(self.losses_op)
+        self.train_op = optimizer.apply_gradients(grads_and_vars,
+                                                  global_step=self.global_steps)
+        # data parallel training: gradients are averaged across replicas
+        # outside the graph and fed back, sharing the optimizer slots
+        self.trainable_vars = [var for _, var in grads_and_vars]
+        self.grads_op = [grad for grad, _ in grads_and_vars]
+        self.grad_phs = [tf.placeholder(dtype=tf.float32, shape=var.get_shape())
+                         for var in self.trainable_vars]
+        self.apply_grads_op = optimizer.apply_gradients(
+            zip(self.grad_phs, self.trainable_vars), global_step=self.global_steps)
 
         # levenshtein distance
         self.levenshtein = tf.reduce_mean(tf.edit_distance(tf.cast(decoded[0], tf.int32),
                                                            self.label_sparse))
+        # per sequence label edits, summed over a corpus for the error rate
+        self.edit_distance_op = tf.edit_distance(tf.cast(decoded[0], tf.int32),
+                                                 self.label_sparse, normalize=False)
 
         # summary
         self.merged_op = tf.summary.merge_all()
         # summary writer
-        self.train_summary_writer = tf.summary.FileWriter(
-            self.log_dir + 'train', graph=graph)
+        self.train_summary_writer = None
+        if log_summaries:
+            self.train_summary_writer = tf.summary.FileWriter(
+                self.log_dir + 'train', graph=graph)
 
     def predict(self, sess, inputs, seq_len, labels=None):
         feed_dict = {self.input_ph: inputs,
@@ -132,16 +230,90 @@ class HWRModel(object):
                 self.decoded_op[0], feed_dict=feed_dict)
             return decoded_seq
 
-    def step(self, sess, inputs, seq_len, labels):
+    def step(self, sess, inputs=None, seq_len=None, labels=None):
+        """
+        inputs None -> the batch is read from the input pipeline
+        """
+        stats = self.timed_step(sess, inputs, seq_len, labels)
+        return stats['global_step'], stats['losses']
+
+    def timed_step(self, sess, inputs=None, seq_len=None, labels=None,
+                   write_summary=True):
+        """
+        Inputs:
+            write_summary: bool, also run merged_op and write the summary
+        Return:
+            stats: dict, global_step, losses, num_samples, num_timesteps,
+                run_time (sec of the session run), summary_time (sec of
+                writing the summary, 0.0 when skipped)
+        """
+        feed_dict = None
+        if inputs is not None:
+            feed_dict = {self.input_ph: inputs,
+                         self.seq_len_ph: seq_len,
+                         self.label_ph: labels}
+        fetches = [self.global_steps, self.train_op, self.losses_op,
+                   self.num_samples_op, self.num_timesteps_op]
+        write_summary = write_summary and self.train_summary_writer is not None
+        if write_summary:
+            fetches.append(self.merged_op)
+        start_time = time.time()
+        results = sess.run(fetches, feed_dict=feed_dict)
+        run_time = time.time() - start_time
+        gloebal_step, _, losses, num_samples, num_timesteps = results[:5]
+        summary_time = 0.0
+        if write_summary:
+            # summary
+            start_time = time.time()
+            self.train_summary_writer.add_summary(
+                results[5], global_step=gloebal_step)
+            summary_time = time.time() - start_time
+        return {'global_step': gloebal_step,
+                'losses': losses,
+                'num_samples': num_samples,
+                'num_timesteps': num_timesteps,
+                'run_time': run_time,
+                'summary_time': summary_time}
+
+    def compute_gradients(self, sess, inputs, seq_len, labels):
+        """
+        Return:
+            grads: list of float arrays, one per trainable_vars
+            losses: float, mean ctc loss of the batch
+        """
         feed_dict = {self.input_ph: inputs,
                      self.seq_len_ph: seq_len,
                      self.label_ph: labels}
-        gloebal_step, summary, _, losses = sess.run(
-            [self.global_steps, self.merged_op, self.train_op, self.losses_op], feed_dict=feed_dict)
-        # summary
-        self.train_summary_writer.add_summary(
-            summary, global_step=gloebal_step)
-        return gloebal_step, losses
+        grads, losses = sess.run(
+            [self.grads_op, self.losses_op], feed_dict=feed_dict)
+        return grads, losses
+
+    def apply_gradients(self, sess, grads):
+        """
+        Inputs:
+            grads: list of float arrays, one per trainable_vars
+        Return:
+            global_step: int, after the update
+        """
+        feed_dict = dict(zip(self.grad_phs, grads))
+        sess.run(self.apply_grads_op, feed_dict=feed_dict)
+        return sess.run(self.global_steps)
+
+    def evaluate(self, sess, inputs, seq_len, labels):
+        """
+        loss, greedy decoding and edit distance of one batch in a single run
+        Return:
+            sample_losses: float array, [batch_size]
+            decoded_seq: SparseTensorValue
+            edit_distance: float array, [batch_size], not normalized
+        """
+        feed_dict = {self.input_ph: inputs,
+                     self.seq_len_ph: seq_len,
+                     self.label_ph: labels}
+        sample_losses, decoded_seq, edit_distance = sess.run(
+            [self.sample_losses_op, self.decoded_op[0], self.edit_distance_op],
+            feed_dict=feed_dict)
+        return sample_losses, decoded_seq, edit_distance
 
     def compute_losses(self, sess, inputs, seq_len, labels):
         feed_dict = {self.input_ph: inputs,
@@ -170,6 +342,8 @@ class TestingConfig(object):
         self.learning_rate = 1e-4
         self.decay_rate = 0
         self.momentum = 0
+        self.gradient_checkpointing = False
+        self.fused_lstm = False
 
 
 def test_model():
@@ -0,0 +1,159 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import numpy as np
+
+# forget_bias of the LSTMCell / LSTMBlockFusedCell in HWRModel
+FORGET_BIAS = 1.0
+
+# same fields as tf.SparseTensorValue, Vocabulary.decode_sparse takes either
+SparseValue = collections.namedtuple('SparseValue', ['indices', 'values', 'dense_shape'])
+
+
+def sigmoid(x):
+    return 0.5 * np.tanh(0.5 * x) + 0.5
+
+
+def reverse_sequence(inputs, seq_len):
+    """
+    numpy tf.reverse_sequence(seq_dim=0, batch_dim=1), padding stays at the end
+
+    Inputs:
+        inputs: array, [padded length, batch_size, ...], time major
+        seq_len: int array, [batch_size]
+    """
+    steps = np.arange(inputs.shape[0])[:, None]
+    index = np.where(steps < seq_len[None, :], seq_len[None, :] - 1 - steps, steps)
+    return inputs[index, np.arange(inputs.shape[1])[None, :]]
+
+
+def ctc_greedy_decode(logits, seq_len):
+    """
+    numpy tf.nn.ctc_greedy_decoder(merge_repeated=True), the blank is the last class
+
+    Inputs:
+        logits: float array, [padded length, batch_size, num_classes], time major
+        seq_len: int array, [batch_size]
+    Return:
+        decoded: SparseValue, indices [num_values, 2] in row-major order
+    """
+    blank = logits.shape[2] - 1
+    best = np.argmax(logits, axis=2)
+    # repeats are merged before the blanks are dropped, as tensorflow does
+    changed = np.ones_like(best, dtype=bool)
+    changed[1:] = best[1:] != best[:-1]
+    keep = changed & (best != blank) & (np.arange(best.shape[0])[:, None] < seq_len[None, :])
+    rows, steps = np.nonzero(keep.T)
+    counts = np.bincount(rows, minlength=best.shape[1])
+    # position of every label within its sequence
+    cols = np.arange(rows.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+    return SparseValue(indices=np.stack([rows, cols], axis=1).astype(np.int64),
+                       values=best[steps, rows].astype(np.int64),
+                       dense_shape=np.array([best.shape[1], np.max(counts, initial=0)],
+                                            dtype=np.int64))
+
+
+class NumpyHWRModel(object):
+    """
+    Inference of HWRModel in numpy only, from the weights written by
+    export_model.py --export_npz: stacked peephole BLSTM, the folded fw/bw
+    merge and class projection, greedy CTC decoding. No tensorflow import,
+    eg: for small boxes or a quick start of the VR server.
+    """
+
+    def __init__(self, weights):
+        """
+        Inputs:
+            weights: dict, name -> array, as in the .npz of export_model.py
+        """
+        self.num_layers = int(weights['num_layers'])
+        self.hidden_size = weights['biases_hidden'].shape[0]
+        self.num_classes = weights['biases_classes'].shape[0]
+        self.layers = []
+        for i in range(self.num_layers):
+            # fw and bw stacked on a leading axis, both directions run as one batch
+            def stack(name):
+                return np.stack([weights['cell_%d_%s_%s' % (i, direction, name)]
+                                 for direction in ['fw', 'bw']]).astype(np.float32)
+            kernel = stack('kernel')
+            input_dims = kernel.shape[1] - self.hidden_size
+            self.layers.append({
+                'input_kernel': kernel[:, :input_dims],
+                'hidden_kernel': kernel[:, input_dims:],
+                'bias': stack('bias')[:, None, :],
+                'w_i_diag': stack('w_i_diag')[:, None, :],
+                'w_f_diag': stack('w_f_diag')[:, None, :],
+                'w_o_diag': stack('w_o_diag')[:, None, :]})
+        self.input_dims = self.layers[0]['input_kernel'].shape[1]
+        # fw/bw merge folded into the class projection, as HWRModel does
+        weights_hidden = weights['weights_hidden']
+        weights_classes = weights['weights_classes']
+        self.weights_merged = (weights_hidden[:, :, None] * weights_classes[None]).reshape(
+            [2 * self.hidden_size, self.num_classes]).astype(np.float32)
+        self.biases_merged = (np.dot(weights['biases_hidden'], weights_classes) +
+                              weights['biases_classes']).astype(np.float32)
+
+    @classmethod
+    def load(cls, npz_path):
+        with np.load(npz_path) as weights:
+            return cls(dict(weights))
+
+    def blstm_layer(self, layer, inputs, seq_len):
+        """
+        Inputs:
+            inputs: float32 array, [padded length, batch_size, layer input dims], time major
+        Return:
+            outputs: float32 array, [padded length, batch_size, 2 * hidden_size], fw then bw
+        """
+        max_len, batch_size, _ = inputs.shape
+        hidden_size = self.hidden_size
+        directions = np.stack([inputs, reverse_sequence(inputs, seq_len)])
+        # input part of all gates of all timesteps in one matmul per direction
+        input_gates = np.matmul(directions.reshape([2, max_len * batch_size, -1]),
+                                layer['input_kernel']).reshape(
+                                    [2, max_len, batch_size, 4 * hidden_size])
+        input_gates += layer['bias'][:, None]
+        c = np.zeros([2, batch_size, hidden_size], dtype=np.float32)
+        h = np.zeros([2, batch_size, hidden_size], dtype=np.float32)
+        outputs = np.zeros([2, max_len, batch_size, hidden_size], dtype=np.float32)
+        for t in range(max_len):
+            gates = input_gates[:, t] + np.matmul(h, layer['hidden_kernel'])
+            # gate order i, j, f, o
+            i, j, f, o = np.split(gates, 4, axis=2)
+            c_new = (sigmoid(f + FORGET_BIAS + layer['w_f_diag'] * c) * c +
+                     sigmoid(i + layer['w_i_diag'] * c) * np.tanh(j))
+            h_new = sigmoid(o + layer['w_o_diag'] * c_new) * np.tanh(c_new)
+            # past the sequence length the state is kept and the output is zero
+            alive = (t < seq_len)[None, :, None]
+            c = np.where(alive, c_new, c)
+            h = np.where(alive, h_new, h)
+            outputs[:, t] = h_new * alive
+        return np.concatenate(
+            [outputs[0], reverse_sequence(outputs[1], seq_len)], axis=2)
+
+    def logits(self, inputs, seq_len):
+        """
+        Inputs:
+            inputs: float32 array, [batch_size, padded length, input_dims]
+            seq_len: int32 array, [batch_size]
+        Return:
+            logits: float32 array, [padded length, batch_size, num_classes], time major
+        """
+        seq_len = np.asarray(seq_len)
+        fwbw = np.transpose(np.asarray(inputs, dtype=np.float32), [1, 0, 2])
+        for layer in self.layers:
+            fwbw = self.blstm_layer(layer, fwbw, seq_len)
+        max_len, batch_size, _ = fwbw.shape
+        # one matmul over all timesteps of the batch
+        logits = np.dot(fwbw.reshape([-1, 2 * self.hidden_size]),
+                        self.weights_merged) + self.biases_merged
+        return logits.reshape([max_len, batch_size, self.num_classes])
+
+    def predict(self, inputs, seq_len):
+        """
+        Return:
+            decoded_seq: SparseValue, as HWRModel.predict, for Vocabulary.decode_sparse
+        """
+        return ctc_greedy_decode(self.logits(inputs, seq_len), np.asarray(seq_len))
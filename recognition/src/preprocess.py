@@ -3,10 +3,17 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import argparse
+import multiprocessing
+import pickle
+from functools import partial
 import xml.etree.ElementTree as ET
 import numpy as np
-import re
-import math
+
+import features
+import dataset
+from feature_cache import FeatureCache
+from reduction import REDUCTION_MODES, check_reduction, reduce_trajectory, reduction_meta, reduction_tag
 
 
 FILE_PATH = os.path.dirname(os.path.realpath(__file__))
@@ -15,6 +22,31 @@ LABEL_DATA_PATH = os.path.join(DATA_PATH, "ascii/")
 STROKES_DATA_PATH = os.path.join(DATA_PATH, "lineStrokes/")
 
 ESCAPE_CHAR = '~!@#$%^&*()_+{}:"<>?`-=[];\',./|\n'
+ESCAPE_TABLE = {ord(char): None for char in ESCAPE_CHAR}
+# points preallocated per lineStrokes file, doubled when exceeded
+INITIAL_POINT_CAPACITY = 1024
+NO_REDUCTION = ('none', 0.0)
+
+
+def parse_label_form(filepath):
+    """
+    Inputs:
+        filepath: string, path of one ascii form, eg: '.../a01/a01-020/a01-020w.txt'
+    Return:
+        labels: dict, line_id (int) -> cleaned label of the textlines after "CSR:"
+    """
+    labels = {}
+    line_counter = -2  # because line start after 2 new lines from "CSR:\n"
+    flag = False
+    with open(filepath, 'r') as f:
+        for line in f:
+            if line.startswith('CSR'):
+                flag = True
+            if flag:
+                line_counter += 1
+                if line_counter > 0:
+                    labels[line_counter] = line.translate(ESCAPE_TABLE)
+    return labels
 
 
 def find_textline_by_id(filename):
@@ -30,235 +62,273 @@ def find_textline_by_id(filename):
     line_id = int(filename[-2:])  # eg: 1
     filepath = os.path.join(
         LABEL_DATA_PATH, dir_name_L1, dir_name_L2, file_name)
-    line_counter = -2  # because line start after 2 new lines from "CSR:\n"
+    return parse_label_form(filepath).get(line_id, '')
 
-    label = []
-    flag = False
-    for line in open(filepath, 'r'):
-        if line.startswith('CSR'):
-            flag = True
-        if flag:
-            line_counter += 1
-        if line_counter == line_id:
-            for char in ESCAPE_CHAR:
-                line = line.replace(char, '')
-            label = line
-            break
-    return label
+
+def list_label_forms(label_dir):
+    """
+    Return:
+        mtimes: dict, form path relative to label_dir -> modification time
+    """
+    mtimes = {}
+    for path_1, _, files in os.walk(label_dir):
+        for file_name in files:
+            if file_name.endswith('.txt'):
+                filepath = os.path.join(path_1, file_name)
+                mtimes[os.path.relpath(filepath, label_dir)] = os.path.getmtime(
+                    filepath)
+    return mtimes
 
 
-def main():
-    # parse STROKES (.xml)
+def build_label_index(label_dir, mtimes):
+    """
+    Inputs:
+        label_dir: string, root of the ascii folders
+        mtimes: dict, forms to index, from list_label_forms
+    Return:
+        label_index: dict, textline id (eg: 'a01-020w-01') -> cleaned label
+    """
+    label_index = {}
+    for rel_path in sorted(mtimes):
+        form_name = os.path.basename(rel_path)[:-4]  # eg: 'a01-020w'
+        labels = parse_label_form(os.path.join(label_dir, rel_path))
+        for line_id, label in labels.items():
+            label_index['%s-%02d' % (form_name, line_id)] = label
+    return label_index
+
+
+def load_label_index(label_dir, cache_path):
+    """
+    Load the label index from cache_path, rebuild and cache it when any
+    ascii form was added, removed or modified since it was built.
+    """
+    mtimes = list_label_forms(label_dir)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['mtimes'] == mtimes:
+            return cached['label_index']
+    label_index = build_label_index(label_dir, mtimes)
+    with open(cache_path, 'wb') as f:
+        pickle.dump({'mtimes': mtimes, 'label_index': label_index}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    print("Built label index of %d textlines: %s" % (len(label_index), cache_path))
+    return label_index
+
+
+def parse_line_strokes(text_line_path):
+    """
+    Stream one lineStrokes file, reading every point exactly once.
+
+    Inputs:
+        text_line_path: string, path of one lineStrokes .xml
+    Return:
+        x_list, y_list: float32 arrays, [num_points], raw coordinates
+        time_stamp: float64 array, [num_points], time relative to the first point
+        offsets: int64 array, [num_strokes + 1], stroke offsets into the points
+        y_max: int, y of the whiteboard DiagonallyOppositeCoords
+    """
+    capacity = INITIAL_POINT_CAPACITY
+    x_list = np.empty(capacity, dtype=np.float32)
+    y_list = np.empty(capacity, dtype=np.float32)
+    time_stamp = np.empty(capacity, dtype=np.float64)
+    offsets = [0]
+    num_points = 0
+    y_max = None
+    stroke_set = None
+    for event, elem in ET.iterparse(text_line_path, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'StrokeSet':
+                stroke_set = elem
+            continue
+        if elem.tag == 'Point':
+            if num_points == capacity:
+                capacity *= 2
+                x_list = np.resize(x_list, capacity)
+                y_list = np.resize(y_list, capacity)
+                time_stamp = np.resize(time_stamp, capacity)
+            attrib = elem.attrib
+            x_list[num_points] = int(attrib['x'])
+            y_list[num_points] = int(attrib['y'])
+            time_stamp[num_points] = float(attrib['time'])
+            num_points += 1
+        elif elem.tag == 'Stroke':
+            if num_points == offsets[-1]:
+                print("Meet 0")
+                exit()
+            offsets.append(num_points)
+            # drop the finished stroke and its points from the tree,
+            # memory stays flat however long the file is
+            elem.clear()
+            if stroke_set is not None:
+                stroke_set.remove(elem)
+        elif elem.tag == 'DiagonallyOppositeCoords':
+            y_max = int(elem.get('y'))
+    x_list = x_list[:num_points]
+    y_list = y_list[:num_points]
+    time_stamp = time_stamp[:num_points] - time_stamp[0]
+    return x_list, y_list, time_stamp, np.asarray(offsets, dtype=np.int64), y_max
+
+
+def text_line_features(text_line_path, reduction=NO_REDUCTION):
+    """
+    Inputs:
+        text_line_path: string, path of one lineStrokes .xml
+        reduction: tuple (mode, param), see reduction.REDUCTION_MODES
+    Return:
+        text_line_data: float32 array, [num_points, features.NUM_FEATURES]
+    """
+    x_list, y_list, time_stamp, offsets, y_max = parse_line_strokes(
+        text_line_path)
+    # normalize x_cor, y_cor by the whiteboard height
+    x_min = np.min(x_list)
+    y_min = np.min(y_list)
+    scale = 1.0 / (y_max - y_min)
+    x_cor = (x_list - x_min) * scale
+    y_cor = (y_list - y_min) * scale
+    x_cor, y_cor, time_stamp, offsets = reduce_trajectory(
+        x_cor, y_cor, time_stamp, offsets, *reduction)
+    return features.compute_features(x_cor, y_cor, time_stamp, offsets)
+
+
+def list_text_lines(strokes_dir):
+    """
+    Inputs:
+        strokes_dir: string, root of the lineStrokes folders
+    Return:
+        text_lines: list of (text_line_id, path), in a deterministic walk order
+    """
+    text_lines = []
+    for path_1, dirs, files in os.walk(strokes_dir):
+        dirs.sort()
+        for file_name in sorted(files):  # TextLine files
+            # split our .xml (eg: a01-020w-01.xml -> a01-020w-01)
+            text_lines.append((file_name[:-4], os.path.join(path_1, file_name)))
+    return text_lines
+
+
+def compute_text_line(text_line_path, reduction=NO_REDUCTION):
+    return {'features': text_line_features(text_line_path, reduction)}
+
+
+def process_text_lines(text_lines, feature_cache=None, reduction=NO_REDUCTION):
+    """
+    Inputs:
+        text_lines: list of (path, label) of labeled textlines
+        feature_cache: FeatureCache or None, reuses features of unchanged files
+        reduction: tuple (mode, param), see reduction.REDUCTION_MODES
+    Return:
+        text_line_data_all: list of float32 arrays, features of the textlines
+        label_text_line_all: list of string, their labels
+    """
     text_line_data_all = []
     label_text_line_all = []
-    for path_1, _, files in os.walk(STROKES_DATA_PATH):
-        files = sorted(files)
-        for file_name in files:  # TextLine files
-            ############# label data #############
-            # split our .xml (eg: a01-020w-01.xml -> a01-020w-01)
-            text_line_id = file_name[:-4]
-            label_text_line = find_textline_by_id(text_line_id)
-            if len(label_text_line) != 0:  # prevent missing data in ascii(label data)
-                label_text_line_all.append(label_text_line)
-                ############# trajectory data #############
-                text_line_path = os.path.join(path_1, file_name)
-                e_tree = ET.parse(text_line_path).getroot()
-                x_list = []
-                y_list = []
-                time_stamp = []
-                first_time = 0.0
-                for atype in e_tree.findall('StrokeSet/Stroke/Point'):
-                    x_list.append(int(atype.get('x')))
-                    y_list.append(int(atype.get('y')))
-                    if len(time_stamp) == 0:
-                        first_time = float(atype.get('time'))
-                        time_stamp.append(0.0)
-                    else:
-                        time_stamp.append(
-                            float(atype.get('time')) - first_time)
-                    # print("x:", atype.get('x'), "y:", atype.get('y'), "time:", float(atype.get('time')) - first_time)
-                    # input()
-                ####curvature and speed #######################################
-                # x y coordinate
-                x_list = np.asarray(x_list, dtype=np.float32)
-                y_list = np.asarray(y_list, dtype=np.float32)
-                x_cor = np.copy(x_list)
-                y_cor = np.copy(y_list)
-                cor_dial = e_tree.findall(
-                    'WhiteboardDescription/DiagonallyOppositeCoords')[0]
-                x_max = int(cor_dial.get('x'))
-                y_max = int(cor_dial.get('y'))
-                x_min = min(x_list)
-                y_min = min(y_list)
-                scale = 1.0 / (y_max - y_min)
-                # normalize x_cor , y_cor
-                x_cor = (x_cor - x_min) * scale
-                y_cor = (y_cor - y_min) * scale
-
-                sin_list = []
-                cos_list = []
-                x_sp_list = []
-                y_sp_list = []
-                pen_up_list = []
-                writing_sin = []
-                writing_cos = []
-
-                for stroke in e_tree.findall('StrokeSet/Stroke'):
-                    x_point, y_point, time_list = [], [], []
-                    for point in stroke.findall('Point'):
-                        x_point.append(int(point.get('x')))
-                        y_point.append(int(point.get('y')))
-                        if len(time_list) == 0:
-                            first_time = float(point.get('time'))
-                            time_list.append(0.0)
-                        else:
-                            time_list.append(
-                                float(point.get('time')) - first_time)
-                    # calculate cos and sin
-                    x_point[:] = [(point - x_min) * scale for point in x_point]
-                    y_point[:] = [(point - y_min) * scale for point in x_point]
-
-                    angle_stroke = []
-                    if len(x_point) < 3:
-                        # print("Oh no",len(x_point))
-                        for _ in range(len(x_point)):
-                            sin_list += [0]
-                            cos_list += [1]
-                    else:
-                        for idx in range(1, len(x_point) - 1):
-                            x_prev = x_point[idx - 1]
-                            y_prev = y_point[idx - 1]
-                            x_next = x_point[idx + 1]
-                            y_next = y_point[idx + 1]
-                            x_now = x_point[idx]
-                            y_now = y_point[idx]
-                            p0 = [x_prev, y_prev]
-                            p1 = [x_now, y_now]
-                            p2 = [x_next, y_next]
-                            v0 = np.array(p0) - np.array(p1)
-                            v1 = np.array(p2) - np.array(p1)
-                            angle = np.math.atan2(
-                                np.linalg.det([v0, v1]), np.dot(v0, v1))
-                            angle_stroke.append(angle)
-                        new_angle_stroke = [0] + angle_stroke + [0]
-                        sin_stroke = np.sin(new_angle_stroke).tolist()
-                        cos_stroke = np.cos(new_angle_stroke).tolist()
-                        sin_list += sin_stroke
-                        cos_list += cos_stroke
-                    # calculate speed
-                    if len(x_point) < 2:
-                        for _ in range(len(x_point)):
-                            x_sp_list += [0]
-                            y_sp_list += [0]
-
-                        if len(x_point) < 1:
-                            print("Meet 0")
-                            exit()
-                        x_sp = [0]
-                        y_sp = [0]
-
-                    else:
-                        time_list = np.asarray(time_list, dtype=np.float32)
-                        time_list_moved = np.array(time_list)[1:]
-                        time_diff = np.subtract(
-                            time_list_moved, time_list[:-1])
-                        for idx, v in enumerate(time_diff):
-                            if v == 0:
-                                time_diff[idx] = 0.001
-                        x_point_moved = np.array(x_point)[1:]
-                        y_point_moved = np.array(y_point)[1:]
-                        x_diff = np.subtract(x_point_moved, x_point[:-1])
-                        y_diff = np.subtract(y_point_moved, y_point[:-1])
-                        x_sp = np.divide(x_diff, time_diff).tolist()
-                        y_sp = np.divide(y_diff, time_diff).tolist()
-                        x_sp = [0] + x_sp
-                        y_sp = [0] + y_sp
-                        x_sp_list += x_sp
-                        y_sp_list += y_sp
-                    # pen up and down
-                    pen_up = [1] * (len(x_point) - 1) + [0]
-                    pen_up_list += pen_up
-                    # writing direction
-                    w_sin_stroke = []
-                    w_cos_stroke = []
-                    for idx, x_v in enumerate(x_sp):
-                        y_v = y_sp[idx]
-                        slope = np.sqrt(x_v * x_v + y_v * y_v)
-                        if slope != 0:
-                            w_sin_stroke.append(y_v / slope)
-                            w_cos_stroke.append(x_v / slope)
-                        else:
-                            w_sin_stroke.append(0)
-                            w_cos_stroke.append(1)
-                    writing_sin += w_sin_stroke
-                    writing_cos += w_cos_stroke
-
-                ####curvature done####################
-                time_stamp = np.asarray(time_stamp, dtype=np.float32)
-                sin_list = np.asarray(sin_list, dtype=np.float32)
-                cos_list = np.asarray(cos_list, dtype=np.float32)
-                x_sp_list = np.asarray(x_sp_list, dtype=np.float32)
-                y_sp_list = np.asarray(y_sp_list, dtype=np.float32)
-                pen_up_list = np.asarray(pen_up_list, dtype=np.float32)
-                writing_cos = np.asarray(writing_cos, dtype=np.float32)
-                writing_sin = np.asarray(writing_sin, dtype=np.float32)
-                # x y coordinate
-
-                # time_list = np.asarray(time_list, dtype=np.float32)
-                # # time 1st order
-                # time_list_moved = np.array(time_list)
-                # time_list_moved = time_list_moved[1:]
-                # time_list_new = np.subtract(
-                #     time_list_moved, time_list[:-1])
-                # for idx, v in enumerate(time_list_new):
-                #     if v == 0:
-                #         time_list_new[idx] = 0.001  # prevent divide by 0
-                # x_list_moved = np.array(x_list)
-                # x_list_moved = x_list_moved[1:]
-                # # x_list throw away the last element
-                # x_list_new = np.subtract(x_list_moved, x_list[:-1])
-                # # x_list_new = np.divide(x_list_new, time_list_new)
-                # # y 1st order
-                # y_list_moved = np.array(y_list)
-                # y_list_moved = y_list_moved[1:]
-                # y_list_new = np.subtract(y_list_moved, y_list[:-1])
-                # y_list_new = np.divide(y_list_new, time_list_new)
-                # stack x', y', time
-                # print(x_sp_list.shape)
-                # print(y_sp_list.shape)
-                # print(x_cor.shape)
-                # print(y_cor.shape)
-                # print(sin_list.shape)
-                # print(cos_list.shape)
-                # print(time_stamp.shape)
-                # print(writing_sin.shape)
-                # print(writing_cos.shape)
-                # print(pen_up_list.shape)
-                text_line_data = np.stack(
-                    (x_sp_list, y_sp_list, x_cor, y_cor, sin_list, cos_list, writing_sin, writing_cos, pen_up_list, time_stamp), axis=1)
-                # (x_cor, y_cor, sin_list, cos_list, time_stamp), axis=1)
-                # text_line_data = np.stack(
-                #     (x_list, y_list, time_list), axis=1)
-                temp_length = text_line_data.shape[0]
-                # subsampling
-                # text_line_data = text_line_data[[
-                #     i % 3 == 0 for i in range(temp_length)]]
-                text_line_data_all.append(text_line_data)
-        print("Finished a file ", files)
-        # print(text_line_data)
-        # print(text_line_data.shape)
-        # print(text_line_path)
-        # print(np.array(text_line_data_all).shape)
-        # input()
-
-    text_line_data_all = np.array(text_line_data_all)
-    label_text_line_all = np.array(label_text_line_all)
-    print(text_line_data_all.shape)
-    print(label_text_line_all.shape)
-    # save as .npy
-    np.save("data", text_line_data_all)
-    np.save("label", label_text_line_all)
-    print("Successfully saved!")
+    for text_line_path, label_text_line in text_lines:
+        label_text_line_all.append(label_text_line)
+        if feature_cache is None:
+            text_line_data_all.append(
+                text_line_features(text_line_path, reduction))
+        else:
+            text_line_data_all.append(feature_cache.lookup(
+                text_line_path, partial(compute_text_line, reduction=reduction))['features'])
+    return text_line_data_all, label_text_line_all
+
+
+def process_shard(args):
+    """
+    Inputs:
+        args: tuple (shard_id, text_lines, shard_dir, feature_cache, reduction)
+    Return:
+        shard_path: string, per-shard dataset directory
+    """
+    shard_id, text_lines, shard_dir, feature_cache, reduction = args
+    text_line_data_all, label_text_line_all = process_text_lines(
+        text_lines, feature_cache, reduction)
+    shard_path = os.path.join(shard_dir, "shard_%05d" % shard_id)
+    dataset.save_dataset(shard_path, text_line_data_all, label_text_line_all)
+    print("Finished shard %d, %d textlines" % (shard_id, len(text_lines)))
+    if feature_cache is not None:
+        feature_cache.show()
+    return shard_path
+
+
+def split_shards(text_lines, num_shards):
+    """ contiguous shards, concatenating them in shard order restores text_lines """
+    bounds = np.linspace(0, len(text_lines), num_shards + 1).astype(np.int64)
+    return [text_lines[bounds[i]:bounds[i + 1]] for i in range(num_shards)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help="number of ingest processes, 1 runs serially")
+    parser.add_argument('--num_shards', type=int, default=None,
+                        help="number of shards, default 4 per worker")
+    parser.add_argument('--shard_dir', type=str, default='shards',
+                        help="directory of per-shard outputs")
+    parser.add_argument('--label_index', type=str,
+                        default=os.path.join(DATA_PATH, 'label_index.pkl'),
+                        help="cache of the textline id -> label index")
+    parser.add_argument('--feature_cache', type=str,
+                        default=os.path.join(DATA_PATH, 'feature_cache'),
+                        help="per file feature cache directory, empty string disables it")
+    parser.add_argument('--output_dir', type=str,
+                        default=os.path.join(DATA_PATH, 'iam'),
+                        help="output dataset directory")
+    parser.add_argument('--reduction', type=str, default='none',
+                        choices=REDUCTION_MODES,
+                        help="sequence reduction: none, resample (equidistant) or rdp")
+    parser.add_argument('--reduction_param', type=float, default=0.0,
+                        help="resample spacing or rdp tolerance, in units of the line height")
+    args = parser.parse_args()
+    reduction = (args.reduction, args.reduction_param)
+    check_reduction(*reduction)
+
+    label_index = load_label_index(LABEL_DATA_PATH, args.label_index)
+    # parse STROKES (.xml), skip missing data in ascii(label data)
+    text_lines = [(text_line_path, label_index[text_line_id])
+                  for text_line_id, text_line_path in list_text_lines(STROKES_DATA_PATH)
+                  if label_index.get(text_line_id)]
+    feature_cache = None
+    if args.feature_cache:
+        feature_cache = FeatureCache(args.feature_cache, version='%d/%s' % (
+            features.FEATURE_VERSION, reduction_tag(*reduction)))
+    if args.num_workers <= 1:
+        text_line_data_all, label_text_line_all = process_text_lines(
+            text_lines, feature_cache, reduction)
+        if feature_cache is not None:
+            feature_cache.show()
+    else:
+        num_shards = args.num_shards or args.num_workers * 4
+        num_shards = max(1, min(num_shards, len(text_lines)))
+        if not os.path.exists(args.shard_dir):
+            os.makedirs(args.shard_dir)
+        shard_args = [(shard_id, shard, args.shard_dir, feature_cache, reduction)
+                      for shard_id, shard in enumerate(split_shards(text_lines, num_shards))]
+        pool = multiprocessing.Pool(args.num_workers)
+        try:
+            # imap keeps shard order, so the result equals a serial run
+            shard_paths = list(pool.imap(process_shard, shard_args))
+        finally:
+            pool.close()
+            pool.join()
+        text_line_data_all = []
+        label_text_line_all = []
+        for shard_path in shard_paths:
+            shard = dataset.RaggedDataset(shard_path)
+            for idx in range(len(shard)):
+                text_line_data_all.append(np.array(shard.sequence(idx)))
+                label_text_line_all.append(shard.text_of(idx))
+
+    print(len(text_line_data_all))
+    print(len(label_text_line_all))
+    meta = {'source': 'IAM-OnDB',
+            'feature_version': features.FEATURE_VERSION,
+            'feature_names': list(features.FEATURE_NAMES)}
+    meta.update(reduction_meta(*reduction))
+    dataset.save_dataset(args.output_dir, text_line_data_all, label_text_line_all,
+                         meta=meta)
+    print("Successfully saved!", args.output_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+# 'none': keep every point
+# 'resample': equidistant points along each stroke, param is the arc-length spacing
+# 'rdp': Ramer-Douglas-Peucker simplification of each stroke, param is the tolerance
+REDUCTION_MODES = ('none', 'resample', 'rdp')
+
+
+def check_reduction(mode, param):
+    if mode not in REDUCTION_MODES:
+        raise ValueError("unknown reduction mode %r, expected one of %s" %
+                         (mode, ', '.join(REDUCTION_MODES)))
+    if mode != 'none' and not param > 0:
+        raise ValueError("reduction %r needs a positive param, got %r" % (mode, param))
+
+
+def reduction_tag(mode, param):
+    """ string identifying a reduction, eg: 'rdp:0.005' """
+    if mode == 'none':
+        return 'none'
+    return '%s:%r' % (mode, float(param))
+
+
+def reduction_meta(mode, param):
+    """ dataset meta.json entries """
+    return {'reduction': mode,
+            'reduction_param': None if mode == 'none' else float(param)}
+
+
+def resample_equidistant(x, y, time_stamp, offsets, spacing):
+    """
+    Resample every stroke to points spaced spacing apart along its arc length,
+    keeping the first and last point of each stroke, time is interpolated.
+
+    Inputs:
+        x, y, time_stamp: 1-d arrays, [num_points]
+        offsets: int array, [num_strokes + 1], stroke offsets into the points
+        spacing: float, arc length between consecutive points
+    Return:
+        x, y, time_stamp, offsets: the resampled trajectory
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    time_stamp = np.asarray(time_stamp, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_points = x.shape[0]
+    lengths = np.diff(offsets)
+    offsets = np.concatenate([[0], np.cumsum(lengths[lengths > 0])])
+    if num_points == 0:
+        return x, y, time_stamp, offsets
+    starts = offsets[:-1]
+    stroke_ids = np.repeat(np.arange(starts.shape[0]), np.diff(offsets))
+
+    # arc length of each point within its stroke
+    segment = np.zeros(num_points)
+    segment[1:] = np.hypot(x[1:] - x[:-1], y[1:] - y[:-1])
+    segment[starts] = 0.0
+    arc = np.cumsum(segment)
+    arc -= arc[starts][stroke_ids]
+    stroke_length = arc[offsets[1:] - 1]
+
+    # strokes laid out on one increasing axis, separated by a gap so that
+    # interpolation never mixes two strokes
+    gap = spacing
+    base = np.concatenate([[0.0], np.cumsum(stroke_length + gap)[:-1]])
+    position = arc + base[stroke_ids]
+
+    # samples at 0, spacing, 2 * spacing, ... plus the end of each stroke
+    num_samples = np.floor(stroke_length / spacing).astype(np.int64) + 1
+    sample_stroke = np.repeat(np.arange(starts.shape[0]), num_samples)
+    sample_offsets = np.concatenate([[0], np.cumsum(num_samples)])
+    sample_rank = np.arange(sample_offsets[-1]) - sample_offsets[:-1][sample_stroke]
+    sample_position = base[sample_stroke] + sample_rank * spacing
+    last_sample = sample_position[sample_offsets[1:] - 1]
+    stroke_end = base + stroke_length
+    needs_end = stroke_end - last_sample > 1e-12
+    sample_position = np.insert(sample_position, sample_offsets[1:][needs_end],
+                                stroke_end[needs_end])
+    new_lengths = num_samples + needs_end
+    new_offsets = np.concatenate([[0], np.cumsum(new_lengths)])
+
+    # repeated points give repeated positions, np.interp would then move
+    # the time of a sample off them, only the first point of each run stays
+    distinct = segment > 0
+    distinct[starts] = True
+    position = position[distinct]
+    new_x = np.interp(sample_position, position, x[distinct])
+    new_y = np.interp(sample_position, position, y[distinct])
+    new_time = np.interp(sample_position, position, time_stamp[distinct])
+    return new_x, new_y, new_time, new_offsets
+
+
+def rdp_keep_mask(x, y, epsilon):
+    """
+    Inputs:
+        x, y: 1-d arrays, points of one stroke
+        epsilon: float, maximum distance of a dropped point to the simplified stroke
+    Return:
+        keep: bool array, points kept by Ramer-Douglas-Peucker
+    """
+    num_points = x.shape[0]
+    keep = np.zeros(num_points, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    stack = [(0, num_points - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        seg_x = x[last] - x[first]
+        seg_y = y[last] - y[first]
+        seg_norm = np.hypot(seg_x, seg_y)
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        if seg_norm == 0:
+            dist = np.hypot(px, py)
+        else:
+            dist = np.abs(seg_x * py - seg_y * px) / seg_norm
+        idx = np.argmax(dist)
+        if dist[idx] > epsilon:
+            split = first + 1 + idx
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def rdp_simplify(x, y, time_stamp, offsets, epsilon):
+    """
+    Simplify every stroke with Ramer-Douglas-Peucker, kept points are unchanged.
+
+    Inputs:
+        x, y, time_stamp: 1-d arrays, [num_points]
+        offsets: int array, [num_strokes + 1], stroke offsets into the points
+        epsilon: float, tolerance in coordinate units
+    Return:
+        x, y, time_stamp, offsets: the simplified trajectory
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    time_stamp = np.asarray(time_stamp, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    keep = np.zeros(x.shape[0], dtype=bool)
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        if end > start:
+            keep[start:end] = rdp_keep_mask(x[start:end], y[start:end], epsilon)
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    new_offsets = np.unique(kept_before[offsets])
+    return x[keep], y[keep], time_stamp[keep], new_offsets
+
+
+def reduce_trajectory(x, y, time_stamp, offsets, mode, param):
+    """
+    Apply the configured reduction, see REDUCTION_MODES.
+    """
+    check_reduction(mode, param)
+    if mode == 'resample':
+        return resample_equidistant(x, y, time_stamp, offsets, param)
+    if mode == 'rdp':
+        return rdp_simplify(x, y, time_stamp, offsets, param)
+    return x, y, time_stamp, offsets
@@ -0,0 +1,187 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import multiprocessing
+
+FILE_PATH = os.path.dirname(os.path.abspath(__file__))
+TRAIN_SCRIPT = os.path.join(FILE_PATH, 'train_blstm.py')
+RESULTS_FILE = 'results.json'
+LOG_FILE = 'train.log'
+# native thread pools besides the tensorflow session ones
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+RESULT_FIELDS = ['best_cer', 'best_wer', 'best_loss', 'best_epoch', 'best_step']
+POLL_SECS = 5
+# ops run side by side, eg: the fw and bw lstm, the rest of the share goes to intra op
+INTER_OP_THREADS = 2
+# train_blstm.py flags holding paths
+PATH_FLAGS = ['data_dir', 'vr_dataset_dir', 'checkpoints_dir', 'log_dir',
+              'restore_path', 'throughput_csv', 'results_file']
+
+
+def parse_grid(specs):
+    """
+    Inputs:
+        specs: list of string, eg: ['hidden_size=64,128', 'learning_rate=0.001,0.0003']
+    Return:
+        runs: list of dict, flag name -> value string, the cartesian product
+    """
+    names = []
+    choices = []
+    for spec in specs:
+        name, values = spec.split('=', 1)
+        names.append(name.lstrip('-'))
+        choices.append(values.split(','))
+    return [dict(zip(names, values)) for values in itertools.product(*choices)]
+
+
+def absolute_path(path):
+    # the trainer appends file names to directories, keep their trailing slash
+    absolute = os.path.abspath(path)
+    if path.endswith(os.sep) and not absolute.endswith(os.sep):
+        absolute += os.sep
+    return absolute
+
+
+def absolute_paths(args):
+    """
+    Runs start in the directory of train_blstm.py, paths given relative to
+    the directory of the sweep are made absolute first.
+    Inputs:
+        args: list of string, train_blstm.py arguments, --flag=value or --flag value
+    Return:
+        args: list of string, path flags absolute
+    """
+    result = []
+    is_path = False
+    for arg in args:
+        if is_path:
+            arg = absolute_path(arg)
+            is_path = False
+        elif arg.startswith('-'):
+            name, has_value, value = arg.lstrip('-').partition('=')
+            if name in PATH_FLAGS:
+                if has_value:
+                    arg = '--%s=%s' % (name, absolute_path(value))
+                else:
+                    is_path = True
+        result.append(arg)
+    return result
+
+
+def run_name(overrides):
+    return '_'.join('%s-%s' % (name, value) for name, value in sorted(overrides.items())) or 'default'
+
+
+def launch(overrides, run_dir, threads, train_args):
+    """
+    Start one train_blstm.py process, its outputs all go under run_dir.
+    Return:
+        process: subprocess.Popen
+        log_file: file, stdout and stderr of the process, closed by the caller
+    """
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+    command = [sys.executable, TRAIN_SCRIPT] + absolute_paths(
+        list(train_args) + ['--%s=%s' % (name, value) for name, value in sorted(overrides.items())])
+    command += ['--checkpoints_dir=%s/' % os.path.join(run_dir, 'checkpoints'),
+                '--log_dir=%s/' % os.path.join(run_dir, 'log'),
+                '--results_file=%s' % os.path.join(run_dir, RESULTS_FILE),
+                '--intra_op_threads=%d' % max(1, threads - INTER_OP_THREADS),
+                '--inter_op_threads=%d' % min(INTER_OP_THREADS, threads),
+                '--pipeline_threads=%d' % max(1, threads // 2)]
+    env = dict(os.environ)
+    for var in THREAD_ENV_VARS:
+        env[var] = str(threads)
+    log_file = open(os.path.join(run_dir, LOG_FILE), 'w')
+    # train_blstm.py resolves its default paths from its own directory
+    process = subprocess.Popen(command, cwd=FILE_PATH, env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    return process, log_file
+
+
+def collect(runs, run_dirs, return_codes):
+    """
+    Return:
+        table: list of dict, one row per run, best validation cer first
+    """
+    table = []
+    for overrides, run_dir, return_code in zip(runs, run_dirs, return_codes):
+        row = dict(overrides)
+        row['run'] = os.path.basename(run_dir)
+        row['return_code'] = return_code
+        results_path = os.path.join(run_dir, RESULTS_FILE)
+        if os.path.exists(results_path):
+            with open(results_path, 'r') as f:
+                row.update(json.load(f))
+        table.append(row)
+    table.sort(key=lambda row: row.get('best_cer', float('inf')))
+    return table
+
+
+def show(table, fields):
+    widths = [max([len(field)] + [len(str(row.get(field, ''))) for row in table])
+              for field in fields]
+    print('  '.join(field.ljust(width) for field, width in zip(fields, widths)))
+    for row in table:
+        print('  '.join(str(row.get(field, '')).ljust(width)
+                        for field, width in zip(fields, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="run train_blstm.py over a grid of flags, other arguments are passed to every run")
+    parser.add_argument('--grid', type=str, nargs='+', required=True,
+                        help="flag=value1,value2 ..., eg: hidden_size=64,128 num_layers=1,2")
+    parser.add_argument('--parallel', type=int, default=2,
+                        help="number of runs at the same time")
+    parser.add_argument('--threads_per_run', type=int, default=None,
+                        help="threads of each run, default the cores divided by parallel")
+    parser.add_argument('--sweep_dir', type=str, default='../sweep/',
+                        help="one sub directory of checkpoints, logs and results per run")
+    args, train_args = parser.parse_known_args()
+    threads = args.threads_per_run or max(1, multiprocessing.cpu_count() // args.parallel)
+
+    runs = parse_grid(args.grid)
+    sweep_dir = os.path.abspath(args.sweep_dir)
+    run_dirs = [os.path.join(sweep_dir, '%03d_%s' % (i, run_name(overrides)))
+                for i, overrides in enumerate(runs)]
+    print("%d runs, %d at a time, %d threads each" % (len(runs), args.parallel, threads))
+
+    # every run memory-maps the same dataset files, the page cache holds one copy
+    return_codes = [None] * len(runs)
+    running = {}
+    pending = list(range(len(runs)))
+    while pending or running:
+        while pending and len(running) < args.parallel:
+            i = pending.pop(0)
+            running[i] = launch(runs[i], run_dirs[i], threads, train_args)
+            print("started %s" % run_dirs[i])
+        time.sleep(POLL_SECS)
+        for i, (process, log_file) in list(running.items()):
+            if process.poll() is not None:
+                return_codes[i] = process.returncode
+                log_file.close()
+                del running[i]
+                print("finished %s, return code %d" % (run_dirs[i], process.returncode))
+
+    table = collect(runs, run_dirs, return_codes)
+    fields = sorted(set(name for overrides in runs for name in overrides))
+    fields = ['run'] + fields + RESULT_FIELDS + ['return_code']
+    show(table, fields)
+    with open(os.path.join(sweep_dir, 'results.csv'), 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,22 +3,41 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import json
 import time
 import numpy as np
 import tensorflow as tf
 import model_blstm
+import dataset
+import batching
+import checkpointing
+import evaluation
+import input_pipeline
+import instrumentation
+import training_state
+import vocabulary
 
 
 FLAGS = tf.app.flags.FLAGS
 
 tf.app.flags.DEFINE_string('data_dir', '../data/',
                            "data directory")
+tf.app.flags.DEFINE_string('dataset_name', 'iam',
+                           "dataset directory under data_dir, written by preprocess.py")
+tf.app.flags.DEFINE_string('vr_dataset_dir', 'vr_valid/',
+                           "VR validation dataset directory, written by vr_preprocess.py")
 tf.app.flags.DEFINE_string('checkpoints_dir', '../checkpoints/',
                            "training checkpoints directory")
 tf.app.flags.DEFINE_string('log_dir', '../train_log/',
                            "summary directory")
 tf.app.flags.DEFINE_string('restore_path', None,
                            "path of saving model eg: ../checkpoints/model.ckpt-5")
+tf.app.flags.DEFINE_boolean('resume', False,
+                            "continue from the latest checkpoint in checkpoints_dir, mid-epoch if saved there")
+tf.app.flags.DEFINE_integer('seed', None,
+                            "seed of the batch shuffling and the graph, None -> random")
+tf.app.flags.DEFINE_integer('save_steps', 0,
+                            "also save a checkpoint every that many steps, 0 -> only every save_freq epoches")
 tf.app.flags.DEFINE_integer('batch_size', 128,
                             "mini-batch size")
 tf.app.flags.DEFINE_integer('total_epoches', 300,
@@ -39,21 +58,53 @@ tf.app.flags.DEFINE_float('decay_rate', 0.99,
                           "decay rate of RMSPropOptimizer")
 tf.app.flags.DEFINE_float('momentum', 0.9,
                           "momentum of RMSPropOptimizer")
-tf.app.flags.DEFINE_float('max_length', 1940,
-                          "pad to same length")
-tf.app.flags.DEFINE_integer('label_pad', 63,
-                            "label pad size")
+tf.app.flags.DEFINE_integer('label_pad', 0,
+                            "label pad size, 0 pads to the longest label of each batch")
+tf.app.flags.DEFINE_integer('num_buckets', 10,
+                            "number of sequence length buckets, 1 disables bucketing")
+tf.app.flags.DEFINE_integer('max_tokens', 0,
+                            "max padded timesteps per batch (batch size * longest sequence), 0 disables it")
+tf.app.flags.DEFINE_boolean('gradient_checkpointing', False,
+                            "recompute each blstm layer during backprop, less activation memory for more compute")
+tf.app.flags.DEFINE_boolean('fused_lstm', False,
+                            "run each lstm on the fused block kernel, convert_checkpoint.py maps checkpoints across")
+tf.app.flags.DEFINE_boolean('use_input_pipeline', True,
+                            "read training batches from a prefetching tf.data pipeline instead of feed_dict")
+tf.app.flags.DEFINE_integer('pipeline_threads', 2,
+                            "threads padding training batches in the input pipeline")
+tf.app.flags.DEFINE_integer('prefetch_batches', 2,
+                            "training batches prepared ahead of the model")
+tf.app.flags.DEFINE_integer('summary_freq', 100,
+                            "steps between two merged_op summaries and throughput points")
+tf.app.flags.DEFINE_string('throughput_csv', None,
+                           "per step timing CSV, default log_dir/throughput.csv")
+tf.app.flags.DEFINE_boolean('async_checkpoint', True,
+                            "write checkpoints from a background thread out of a variable snapshot")
+tf.app.flags.DEFINE_boolean('inline_validation', True,
+                            "validate after every epoch, disable it when eval_worker.py runs")
+tf.app.flags.DEFINE_integer('intra_op_threads', 0,
+                            "threads per op of the session, 0 -> tensorflow default")
+tf.app.flags.DEFINE_integer('inter_op_threads', 0,
+                            "ops run in parallel by the session, 0 -> tensorflow default")
+tf.app.flags.DEFINE_string('results_file', None,
+                           "json file updated with the best validation result, eg: for sweep.py")
 tf.app.flags.DEFINE_boolean('if_valid_vr', False,
                             "label pad size")
 tf.app.flags.DEFINE_boolean('if_lowercase_only', False,
                             "if letter table only contain lowercase")
 
-if FLAGS.if_lowercase_only:
-    letter_table = [' ', 'a', 'b', 'c', 'd', 'e', 'f', 'g', 'ga', 'h', 'i', 'j', 'k', 'km', 'l', 'm', 'n', 'o', 'p', 'pt',
-                    'q', 'r', 's', 'sc', 'sp', 't', 'u', 'v', 'w', 'x', 'y', 'z', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '<b>']
-else:
-    letter_table = [' ', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z', 'a', 'b', 'c', 'd', 'e', 'f',
-                    'g', 'ga', 'h', 'i', 'j', 'k', 'km', 'l', 'm', 'n', 'o', 'p', 'pt', 'q', 'r', 's', 'sc', 'sp', 't', 'u', 'v', 'w', 'x', 'y', 'z', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '<b>']
+_vocab = None
+
+
+def get_vocab():
+    """
+    Letter table of --if_lowercase_only, built on first use: reading FLAGS at
+    import time would parse argv before importers define their own flags.
+    """
+    global _vocab
+    if _vocab is None:
+        _vocab = vocabulary.get_vocabulary(FLAGS.if_lowercase_only)
+    return _vocab
 
 
 class ModelConfig(object):
@@ -76,8 +127,10 @@ class ModelConfig(object):
         self.learning_rate = FLAGS.learning_rate
         self.decay_rate = FLAGS.decay_rate
         self.momentum = FLAGS.momentum
-        self.max_length = FLAGS.max_length
-        self.label_pad = FLAGS.label_pad
+        # None -> dense labels as wide as the longest label of the batch
+        self.label_pad = FLAGS.label_pad or None
+        self.gradient_checkpointing = FLAGS.gradient_checkpointing
+        self.fused_lstm = FLAGS.fused_lstm
         self.if_valid_vr = FLAGS.if_valid_vr
 
     def show(self):
@@ -95,208 +148,335 @@ class ModelConfig(object):
         print("learning_rate:", self.learning_rate)
         print("decay_rate:", self.decay_rate)
         print("momentum:", self.momentum)
-        print("max_length:", self.max_length)
         print("label_pad:", self.label_pad)
+        print("gradient_checkpointing:", self.gradient_checkpointing)
+        print("fused_lstm:", self.fused_lstm)
         print("if_valid_vr:", self.if_valid_vr)
 
 
+def split_train_valid(num_examples):
+    """
+    Return:
+        train_idx, valid_idx: int arrays, first 90% of the examples train, the rest validate
+    """
+    return np.split(np.arange(num_examples), [num_examples * 9 // 10])
+
+
+def eval_batches(seq_len, indexes, batch_size):
+    """
+    Return:
+        batches: list of int arrays, length-bucketed batches of indexes, the same every call
+    """
+    sampler = batching.BucketBatchSampler(
+        seq_len[indexes], batch_size,
+        num_buckets=FLAGS.num_buckets, max_tokens=FLAGS.max_tokens,
+        shuffle=False)
+    return [indexes[batch] for batch in sampler.batches()]
+
+
+def batch_getter(padder, default_set, label_pad):
+    """
+    Inputs:
+        padder: batching.BatchPadder, the inputs are views of its buffer
+        default_set: dataset.RaggedDataset, read when no data_set is given
+        label_pad: int, None -> dense labels as wide as the longest label
+    Return:
+        get_batch: function, (indexes, data_set) -> input, sequence length, label
+    """
+    def get_batch(indexes, data_set=default_set):
+        input_batch, seq_len_batch = padder.pad(data_set, indexes)
+        dense_batch = data_set.dense_labels(indexes, label_pad)
+        return input_batch, seq_len_batch, dense_batch
+    return get_batch
+
+
+def restore_checkpoint(sess, saver, state, restore_path):
+    """
+    Restores restore_path, under --resume the latest resumable checkpoint
+    of checkpoints_dir instead, with the TrainingState saved next to it.
+    A plain --restore_path only warm starts the weights.
+
+    Inputs:
+        state: training_state.TrainingState, loaded in place
+        restore_path: string, None -> nothing to restore
+    Return:
+        restore_path: string, the checkpoint restored, None if none was
+    """
+    if FLAGS.resume:
+        restore_path = training_state.latest_resumable(FLAGS.checkpoints_dir) or restore_path
+    if restore_path is None:
+        return None
+    saver.restore(sess, restore_path)
+    print("Model restored:", restore_path)
+    if FLAGS.resume:
+        saved_state = training_state.read_state(restore_path)
+        if saved_state is not None:
+            state.load(saved_state)
+            print("Resumed at epoch %d, batch %d" % (state.epoch, state.position))
+    return restore_path
+
+
+def checkpoint_saver(sess, saver, state, checkpointer=None):
+    """
+    Inputs:
+        saver: tf.train.Saver, writes in the training thread
+        state: training_state.TrainingState, written next to every checkpoint
+        checkpointer: checkpointing.AsyncCheckpointer, None -> saver is used
+    Return:
+        save_checkpoint: function, (global step) -> None
+    """
+    def save_checkpoint(global_step):
+        snapshot = state.snapshot()
+        if checkpointer is not None:
+            checkpointer.save(
+                sess, FLAGS.checkpoints_dir + "model.ckpt", global_step=global_step,
+                on_saved=lambda path: training_state.write_state(path, snapshot))
+        else:
+            save_path = saver.save(
+                sess, FLAGS.checkpoints_dir + "model.ckpt", global_step=global_step)
+            training_state.write_state(save_path, snapshot)
+            print("Model saved in file: %s" % save_path)
+    return save_checkpoint
+
+
+def read_results(path):
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+class EpochReporter(object):
+    """
+    End of epoch work of train_blstm.py and data_parallel.py: the mean loss
+    summary, validation on the IAM and the VR splits (unless
+    --noinline_validation), the best result of --results_file and a
+    checkpoint every save_freq epoches.
+    """
+
+    def __init__(self, graph, get_batch, valid_set, valid_batches,
+                 vr_valid_set=None, vr_valid_batches=None, best_result=None):
+        """
+        Inputs:
+            get_batch: function, as returned by batch_getter
+            vr_valid_set: dataset.RaggedDataset, None -> no VR validation
+            best_result: dict, best validation so far, eg: of a resumed run
+        """
+        self.get_batch = get_batch
+        self.valid_set = valid_set
+        self.valid_batches = valid_batches
+        self.vr_valid_set = vr_valid_set
+        self.vr_valid_batches = vr_valid_batches
+        self.best_result = best_result
+        self.train_summary_writer = tf.summary.FileWriter(
+            FLAGS.log_dir + 'ephoch_train', graph=graph)
+        self.valid_summary_writer = tf.summary.FileWriter(
+            FLAGS.log_dir + 'ephoch_valid', graph=graph)
+        self.vr_valid_summary_writer = tf.summary.FileWriter(
+            FLAGS.log_dir + 'ephoch_vr_valid', graph=graph)
+
+    def validate(self, sess, model, data_set, batches, summary_writer, global_ephoch, name):
+        """
+        Return:
+            result: dict, as evaluation.evaluate
+        """
+        # loss + decoding + edit distance in one pass
+        result = evaluation.evaluate(
+            sess, model, (self.get_batch(batch, data_set) for batch in batches), get_vocab())
+        # visualize one sequence of the split
+        if result['decoded']:
+            idx = global_ephoch % len(result['decoded'])
+            print('Original %s: %s' % (name, result['originals'][idx]))
+            print('Decoded  %s: %s' % (name, result['decoded'][idx]))
+        print("%s mean loss: %f, cer: %f, wer: %f" %
+              (name, result['loss'], result['cer'], result['wer']))
+        summary_writer.add_summary(
+            evaluation.result_summary(result), global_step=global_ephoch)
+        summary_writer.flush()
+        return result
+
+    def end_epoch(self, sess, model, global_ephoch, global_step, loss_sum,
+                  train_num_batch, seconds, save_checkpoint):
+        """
+        Inputs:
+            global_ephoch: int, epoches done, 1 after the first one
+            loss_sum: float, sum of the mean batch losses of the epoch
+            train_num_batch: int, batches trained on in the epoch
+            seconds: float, training time of the epoch
+            save_checkpoint: function, (global step) -> None
+        """
+        # resumed right at the end of an epoch -> nothing left of it
+        train_num_batch = max(train_num_batch, 1)
+        print("%d epoches, %d steps, mean loss: %f, time cost: %f(sec/batch)" %
+              (global_ephoch, global_step, loss_sum / train_num_batch,
+               seconds / train_num_batch))
+        train_summary = tf.Summary(value=[tf.Summary.Value(
+            tag="ephoch_mean_loss", simple_value=loss_sum / train_num_batch)])
+        self.train_summary_writer.add_summary(train_summary, global_step=global_ephoch)
+        self.train_summary_writer.flush()
+
+        if FLAGS.inline_validation:
+            valid_result = self.validate(
+                sess, model, self.valid_set, self.valid_batches,
+                self.valid_summary_writer, global_ephoch, 'valid')
+            if FLAGS.results_file is not None and (
+                    self.best_result is None or
+                    valid_result['cer'] < self.best_result['best_cer']):
+                self.best_result = {'best_cer': valid_result['cer'],
+                                    'best_wer': valid_result['wer'],
+                                    'best_loss': valid_result['loss'],
+                                    'best_epoch': global_ephoch,
+                                    'best_step': int(global_step)}
+                write_results(FLAGS.results_file, self.best_result)
+            if self.vr_valid_set is not None:
+                self.validate(sess, model, self.vr_valid_set, self.vr_valid_batches,
+                              self.vr_valid_summary_writer, global_ephoch, 'VR valid')
+
+        if (global_ephoch % FLAGS.save_freq) == 0:
+            save_checkpoint(global_step)
+
+
 def train_model():
     with tf.get_default_graph().as_default() as graph:
+        if FLAGS.seed is not None:
+            tf.set_random_seed(FLAGS.seed)
         # config setting
         config = ModelConfig()
         config.show()
-        # load data
-        input_data = np.load(FLAGS.data_dir + 'data.npy')
-        target_data = np.load(FLAGS.data_dir + 'dense.npy').item()
-        label_data = target_data['dense'].astype(np.int32)
-        label_data_length = target_data['length'].astype(np.int32)
-
-        # label_seq_len = target_data['length'].astype(np.int32)
-        seq_len_list = []
-        for _, v in enumerate(input_data):
-            seq_len_list.append(v.shape[0])
-        seq_len_list = np.array(seq_len_list).astype(np.int32)
-        k = np.argmax(seq_len_list)
-        max_length = input_data[k].shape[0]
+        # load data, memory-mapped
+        train_set = dataset.RaggedDataset(FLAGS.data_dir + FLAGS.dataset_name)
+        seq_len_list = train_set.seq_len
 
+        vr_valid_set = vr_valid_batches = None
         if FLAGS.if_valid_vr:
-            vr_valid_data_raw = np.load('VRdataValidation.npy')[
-                :FLAGS.batch_size]
-            vr_valid_target = np.load('VRdenseValidation.npy').item()
-            vr_valid_label_raw = vr_valid_target['dense'].astype(np.int32)[
-                :FLAGS.batch_size]
-            vr_seq_len_list = []
-            for _, v in enumerate(vr_valid_data_raw):
-                vr_seq_len_list.append(v.shape[0])
-            vr_seq_len_list = np.array(vr_seq_len_list).astype(np.int32)
-            # padding each textline to maximum length -> max_length (1940)
-            vr_valid_data = []
-            for _, v in enumerate(vr_valid_data_raw):
-                residual = max_length - v.shape[0]
-                padding_array = np.zeros([residual, FLAGS.input_dims])
-                vr_valid_data.append(
-                    np.concatenate([v, padding_array], axis=0))
-            vr_valid_data = np.array(vr_valid_data)
-            vr_valid_label = []
-            # padding each label to same dense length -> label_pad (64)
-            for _, v in enumerate(vr_valid_label_raw):
-                residual = FLAGS.label_pad - v.shape[0]
-                padding_array = np.zeros([residual]) - 1
-                vr_valid_label.append(
-                    np.concatenate([v, padding_array], axis=0))
-            vr_valid_label = np.array(vr_valid_label).astype(np.int32)
-            print("vr_valid_data.shape", vr_valid_data.shape)
-            print("vr_valid_label.shape", vr_valid_label.shape)
-
-        # padding each textline to maximum length -> max_length (1940)
-        padded_input_data = []
-        for _, v in enumerate(input_data):
-            residual = max_length - v.shape[0]
-            padding_array = np.zeros([residual, FLAGS.input_dims])
-            padded_input_data.append(
-                np.concatenate([v, padding_array], axis=0))
-        padded_input_data = np.array(padded_input_data)
-
-        train_data, valid_data = np.split(
-            padded_input_data, [padded_input_data.shape[0] * 9 // 10])
-        train_seq_len, valid_seq_len = np.split(
-            seq_len_list, [seq_len_list.shape[0] * 9 // 10])
-        train_label, valid_label = np.split(
-            label_data, [label_data.shape[0] * 9 // 10])
-        train_label_length, valid_label_length = np.split(
-            label_data_length, [label_data_length.shape[0] * 9 // 10])
-
-        # number of batches
-        train_num_batch = int(train_label.shape[0] / config.batch_size)
-        valid_num_batch = int(valid_label.shape[0] / config.batch_size)
+            # the whole VR split is evaluated every epoch
+            vr_valid_set = dataset.RaggedDataset(FLAGS.vr_dataset_dir)
+            vr_valid_batches = eval_batches(
+                vr_valid_set.seq_len, np.arange(len(vr_valid_set)), config.batch_size)
+            print("vr_valid examples:", len(vr_valid_set))
+
+        # compact data + indexes, batches are padded on demand
+        train_idx, valid_idx = split_train_valid(len(train_set))
+        sampler_rng = np.random.RandomState(FLAGS.seed)
+        train_sampler = batching.BucketBatchSampler(
+            seq_len_list[train_idx], config.batch_size,
+            num_buckets=FLAGS.num_buckets, max_tokens=FLAGS.max_tokens,
+            rng=sampler_rng)
+        # epoch, batches and position in them, saved with every checkpoint
+        state = training_state.TrainingState(train_sampler, sampler_rng)
+        # validation batches are the same every epoch
+        valid_batches = eval_batches(seq_len_list, valid_idx, config.batch_size)
+
+        # only the compact data and index permutations stay resident,
+        # fed batches are padded into one reused float32 buffer
+        get_batch = batch_getter(batching.BatchPadder(train_set.input_dims),
+                                 train_set, config.label_pad)
+
         # model
-        model = model_blstm.HWRModel(config, graph)
+        train_inputs = None
+        if FLAGS.use_input_pipeline:
+            # shuffled, bucketed and padded in background threads
+            train_pipeline = input_pipeline.InputPipeline(
+                train_set,
+                lambda: [train_idx[batch] for batch in state.remaining_batches()],
+                config.label_pad,
+                num_threads=FLAGS.pipeline_threads,
+                prefetch_batches=FLAGS.prefetch_batches)
+            train_inputs = train_pipeline.get_next()
+        model = model_blstm.HWRModel(config, graph, inputs=train_inputs)
+        checkpointer = None
+        if FLAGS.async_checkpoint:
+            # snapshot variables, written by a background thread
+            checkpointer = checkpointing.AsyncCheckpointer()
         # Add an op to initialize the variables.
-        init = tf.global_variables_initializer()
+        init = tf.group(tf.global_variables_initializer(),
+                        tf.local_variables_initializer())
         # Add ops to save and restore all the variables.
         saver = tf.train.Saver()
-        train_summary_writer = tf.summary.FileWriter(
-            FLAGS.log_dir + 'ephoch_train', graph=graph)
-        valid_summary_writer = tf.summary.FileWriter(
-            FLAGS.log_dir + 'ephoch_valid', graph=graph)
-        vr_valid_summary_writer = tf.summary.FileWriter(
-            FLAGS.log_dir + 'ephoch_vr_valid', graph=graph)
+        # best validation so far, kept across resumes
+        reporter = EpochReporter(
+            graph, get_batch, train_set, valid_batches, vr_valid_set, vr_valid_batches,
+            best_result=read_results(FLAGS.results_file) if FLAGS.resume else None)
+        throughput_logger = instrumentation.ThroughputLogger(
+            FLAGS.log_dir, FLAGS.throughput_csv or FLAGS.log_dir + 'throughput.csv',
+            summary_freq=FLAGS.summary_freq)
+        session_config = tf.ConfigProto(
+            intra_op_parallelism_threads=FLAGS.intra_op_threads,
+            inter_op_parallelism_threads=FLAGS.inter_op_threads)
         # Session
-        with tf.Session() as sess:
+        with tf.Session(config=session_config) as sess:
             sess.run(init)
             # restore model if exist
-            if FLAGS.restore_path is not None:
-                saver.restore(sess, FLAGS.restore_path)
-                print("Model restored:", FLAGS.restore_path)
-            # time cost evaluation
+            restore_checkpoint(sess, saver, state, FLAGS.restore_path)
+            save_checkpoint = checkpoint_saver(sess, saver, state, checkpointer)
+            # time cost evaluation, training steps only
             start_time = time.time()
-            end_time = 0.0
-            for _ in range(config.total_epoches):
-                # Shuffle the data
-                shuffled_indexes = np.random.permutation(train_data.shape[0])
-                train_data = train_data[shuffled_indexes]
-                train_seq_len = train_seq_len[shuffled_indexes]
-                train_label = train_label[shuffled_indexes]
+            num_steps = 0
+            global_step = sess.run(model.global_steps)
+
+            def finish_step(stats, data_time, step_start, write_summary, steps_done):
+                throughput_logger.record(
+                    stats['global_step'], stats['num_samples'], stats['num_timesteps'],
+                    data_time, stats['run_time'], stats['summary_time'],
+                    time.time() - step_start, write_summary)
+                state.step_done()
+                if FLAGS.save_steps > 0 and steps_done % FLAGS.save_steps == 0:
+                    save_checkpoint(stats['global_step'])
+
+            # total_epoches counts the epoches of earlier runs too
+            while state.epoch < config.total_epoches:
                 loss_sum = 0.0
-                for b in range(train_num_batch):
-                    batch_idx = b * config.batch_size
-                    # input, sequence length, label
-                    input_batch = train_data[batch_idx:batch_idx +
-                                             config.batch_size]
-                    seq_len_batch = train_seq_len[batch_idx:batch_idx +
-                                                  config.batch_size]
-                    dense_batch = train_label[batch_idx:batch_idx +
-                                              config.batch_size]
-                    # train
-                    global_step, losses = model.step(sess, input_batch,
-                                                     seq_len_batch, dense_batch)
-                    loss_sum += losses
-                global_ephoch = int(global_step // train_num_batch)
-                # logging per ephoch
-                # validation
-                v_loss_sum = 0.0
-                for v_b in range(valid_num_batch):
-                    v_batch_idx = v_b * config.batch_size
-                    # input, sequence length, label
-                    v_input_batch = valid_data[v_batch_idx:v_batch_idx +
-                                               config.batch_size]
-                    v_seq_len_batch = valid_seq_len[v_batch_idx:v_batch_idx +
-                                                    config.batch_size]
-                    v_dense_batch = valid_label[v_batch_idx:v_batch_idx +
-                                                config.batch_size]
-                    v_losses = model.compute_losses(sess, v_input_batch,
-                                                    v_seq_len_batch, v_dense_batch)
-                    v_loss_sum += v_losses
-
-                # predict result
-                v_batch_idx = global_ephoch % valid_num_batch
-                v_input_batch = valid_data[v_batch_idx:v_batch_idx +
-                                           config.batch_size]
-                v_seq_len_batch = valid_seq_len[v_batch_idx:v_batch_idx +
-                                                config.batch_size]
-                v_dense_batch = valid_label[v_batch_idx:v_batch_idx +
-                                            config.batch_size]
-                v_label_length_batch = valid_label_length[v_batch_idx:v_batch_idx +
-                                                          config.batch_size]
-                #visualize first data in validation batch
-                visual_target_length = v_label_length_batch[0]
-                predict, levenshtein = model.predict(
-                    sess, v_input_batch, v_seq_len_batch, v_dense_batch)
-                str_decoded = ''.join(
-                    [letter_table[x] for x in np.asarray(predict.values[:visual_target_length])])
-                val_original = ''.join(
-                    [letter_table[x] for x in v_dense_batch[0]])
-                end_time = time.time()
-                print('Original val: %s' % val_original)
-                print('Decoded  val: %s' % str_decoded)
-                print("%d epoches, %d steps, mean loss: %f, valid mean loss: %f, time cost: %f(sec/batch), levenshtein: %f" %
-                      (global_ephoch,
-                       global_step,
-                       loss_sum / train_num_batch,
-                       v_loss_sum / valid_num_batch,
-                       (end_time - start_time) / train_num_batch,
-                       levenshtein))
-                start_time = end_time
-                train_summary = tf.Summary(value=[tf.Summary.Value(
-                    tag="ephoch_mean_loss", simple_value=loss_sum / train_num_batch)])
-                valid_summary = tf.Summary(value=[tf.Summary.Value(
-                    tag="ephoch_mean_loss", simple_value=v_loss_sum / valid_num_batch)])
-                train_summary_writer.add_summary(
-                    train_summary, global_step=global_ephoch)
-                valid_summary_writer.add_summary(
-                    valid_summary, global_step=global_ephoch)
-                train_summary_writer.flush()
-                valid_summary_writer.flush()
-
-                # VR validation
-                if FLAGS.if_valid_vr:
-                    vr_v_loss_sum = model.compute_losses(sess, vr_valid_data,
-                                                         vr_seq_len_list, vr_valid_label)
-                    # predict vr result
-                    vr_idx = global_step % FLAGS.batch_size
-                    vr_predict, vr_levenshtein = model.predict(
-                        sess, vr_valid_data[vr_idx:vr_idx + 1], vr_seq_len_list[vr_idx:vr_idx + 1], vr_valid_label[vr_idx:vr_idx + 1])
-                    vr_str_decoded = ''.join(
-                        [letter_table[x] for x in np.asarray(vr_predict.values)])
-                    vr_val_original = ''.join(
-                        [letter_table[x] for x in vr_valid_label[vr_idx]])
-                    print('Original vr_val: %s' % vr_val_original)
-                    print('Decoded  vr_val: %s' % vr_str_decoded)
-
-                    vr_valid_summary = tf.Summary(value=[tf.Summary.Value(
-                        tag="ephoch_mean_loss", simple_value=vr_v_loss_sum)])
-                    vr_valid_summary_writer.add_summary(
-                        vr_valid_summary, global_step=global_ephoch)
-                    vr_valid_summary_writer.flush()
-
-                    print("VR valid mean loss: %f, vr_levenshtein: %f" %
-                          (vr_v_loss_sum, vr_levenshtein))
-
-                if (global_ephoch % FLAGS.save_freq) == 0:
-                    save_path = saver.save(
-                        sess, FLAGS.checkpoints_dir + "model.ckpt",
-                        global_step=global_step)
-                    print("Model saved in file: %s" % save_path)
+                train_num_batch = 0
+                if FLAGS.use_input_pipeline:
+                    # one pass over the shuffled batches per initialization
+                    sess.run(train_pipeline.initializer)
+                    while True:
+                        step_start = time.time()
+                        write_summary = num_steps % FLAGS.summary_freq == 0
+                        try:
+                            stats = model.timed_step(sess, write_summary=write_summary)
+                        except tf.errors.OutOfRangeError:
+                            break
+                        # the session run blocked on the iterator until the
+                        # batch was ready, that part is the data time
+                        data_time = min(train_pipeline.wait_time(train_num_batch, step_start),
+                                        stats['run_time'])
+                        stats['run_time'] -= data_time
+                        num_steps += 1
+                        finish_step(stats, data_time, step_start, write_summary, num_steps)
+                        global_step = stats['global_step']
+                        loss_sum += stats['losses']
+                        train_num_batch += 1
+                else:
+                    # Shuffle the data, bucketed by length
+                    for batch in state.remaining_batches():
+                        step_start = time.time()
+                        write_summary = num_steps % FLAGS.summary_freq == 0
+                        input_batch, seq_len_batch, dense_batch = get_batch(
+                            train_idx[batch])
+                        data_time = time.time() - step_start
+                        # train
+                        stats = model.timed_step(sess, input_batch, seq_len_batch,
+                                                 dense_batch, write_summary=write_summary)
+                        num_steps += 1
+                        finish_step(stats, data_time, step_start, write_summary, num_steps)
+                        global_step = stats['global_step']
+                        loss_sum += stats['losses']
+                        train_num_batch += 1
+                # counted by the state, 1 after the first epoch, across resumes
+                state.epoch_done()
+                reporter.end_epoch(sess, model, state.epoch, global_step, loss_sum,
+                                   train_num_batch, time.time() - start_time, save_checkpoint)
+                start_time = time.time()
+            if checkpointer is not None:
+                # the last checkpoint is complete before the session closes
+                checkpointer.wait()
+            throughput_logger.close()
 
 
 def main(_):
@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import glob
+import pickle
+import numpy as np
+import tensorflow as tf
+
+# sidecar of every checkpoint, eg: model.ckpt-1200.state
+STATE_SUFFIX = '.state'
+
+
+class TrainingState(object):
+    """
+    Position of the trainer in the data: completed epoches, the batches of
+    the current epoch and how many of them are done, plus the random states
+    that draw the next epoches. Saved next to each checkpoint so that a
+    resumed run continues mid-epoch with the very same batches.
+    """
+
+    def __init__(self, sampler, rng):
+        """
+        Inputs:
+            sampler: batching.BucketBatchSampler, drawing its batches from rng
+            rng: np.random.RandomState of the sampler
+        """
+        self.sampler = sampler
+        self.rng = rng
+        self.epoch = 0
+        self.batches = None
+        self.position = 0
+
+    def remaining_batches(self):
+        """
+        Return:
+            batches: list of int arrays, batches of the current epoch not
+                trained on yet, a new epoch is drawn when none is running
+        """
+        if self.batches is None:
+            self.batches = self.sampler.batches()
+            self.position = 0
+        return self.batches[self.position:]
+
+    def step_done(self):
+        self.position += 1
+
+    def epoch_done(self):
+        self.epoch += 1
+        self.batches = None
+        self.position = 0
+
+    def snapshot(self):
+        """
+        Return:
+            state: dict, copy of the current state, picklable
+        """
+        return {'epoch': self.epoch,
+                'batches': None if self.batches is None else list(self.batches),
+                'position': self.position,
+                'sampler_rng': self.rng.get_state(),
+                'numpy_rng': np.random.get_state()}
+
+    def load(self, state):
+        self.epoch = state['epoch']
+        self.batches = state['batches']
+        self.position = state['position']
+        self.rng.set_state(state['sampler_rng'])
+        np.random.set_state(state['numpy_rng'])
+
+
+def write_state(checkpoint_path, state):
+    """
+    Inputs:
+        checkpoint_path: string, as returned by Saver.save
+        state: dict, TrainingState.snapshot() taken with the checkpoint
+    """
+    with open(checkpoint_path + STATE_SUFFIX, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # drop the sidecars of checkpoints removed by the Saver (max_to_keep)
+    checkpoint_dir = os.path.dirname(checkpoint_path) or '.'
+    for path in glob.glob(os.path.join(checkpoint_dir, '*' + STATE_SUFFIX)):
+        if not tf.train.checkpoint_exists(path[:-len(STATE_SUFFIX)]):
+            os.remove(path)
+
+
+def read_state(checkpoint_path):
+    """
+    Return:
+        state: dict, None if the checkpoint has no sidecar, eg: older checkpoints
+    """
+    path = checkpoint_path + STATE_SUFFIX
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def latest_resumable(checkpoint_dir):
+    """
+    An async save makes its checkpoint the latest before the sidecar is
+    written, a run stopped in between leaves the newest one without state.
+
+    Return:
+        checkpoint_path: string, newest checkpoint of checkpoint_dir with a
+            sidecar, else the newest one, None if there is no checkpoint
+    """
+    checkpoint_state = tf.train.get_checkpoint_state(checkpoint_dir)
+    if checkpoint_state is None:
+        return None
+    for path in reversed(checkpoint_state.all_model_checkpoint_paths):
+        if os.path.exists(path + STATE_SUFFIX):
+            return path
+    return checkpoint_state.model_checkpoint_path
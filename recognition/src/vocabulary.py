@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from label_codec import LabelCodec, BLANK_TOKEN
+
+# data/letters.txt with a leading space, the digits and the CTC blank
+LETTER_TABLE = [' ', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z', 'a', 'b', 'c', 'd', 'e', 'f',
+                'g', 'ga', 'h', 'i', 'j', 'k', 'km', 'l', 'm', 'n', 'o', 'p', 'pt', 'q', 'r', 's', 'sc', 'sp', 't', 'u', 'v', 'w', 'x', 'y', 'z', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9', BLANK_TOKEN]
+LOWERCASE_LETTER_TABLE = [' ', 'a', 'b', 'c', 'd', 'e', 'f', 'g', 'ga', 'h', 'i', 'j', 'k', 'km', 'l', 'm', 'n', 'o', 'p', 'pt',
+                          'q', 'r', 's', 'sc', 'sp', 't', 'u', 'v', 'w', 'x', 'y', 'z', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9', BLANK_TOKEN]
+
+
+class Vocabulary(LabelCodec):
+    """
+    Letter table shared by label encoding, training and serving, decodes
+    whole batches of model output back to strings.
+    """
+
+    def __init__(self, table, lowercase=False):
+        super(Vocabulary, self).__init__(table, lowercase=lowercase)
+        self.lookup = np.empty(len(self.table), dtype=object)
+        self.lookup[:] = self.table
+
+    @property
+    def num_classes(self):
+        """ num_labels + 1(blank) """
+        return len(self.table)
+
+    def decode(self, codes):
+        """
+        Inputs:
+            codes: int array, letter table indexes of one sequence, -1 is skipped
+        Return:
+            text: string
+        """
+        codes = np.asarray(codes)
+        return ''.join(self.lookup[codes[codes >= 0]])
+
+    def decode_sparse(self, sparse, batch_size=None):
+        """
+        Decode a whole batch of decoder output at once.
+
+        Inputs:
+            sparse: SparseTensorValue, eg: decoded[0] of ctc_greedy_decoder,
+                indices [num_values, 2] in row-major order
+            batch_size: int, number of sequences, default sparse.dense_shape[0]
+        Return:
+            texts: list of string, one per sequence
+        """
+        if batch_size is None:
+            batch_size = int(sparse.dense_shape[0])
+        rows = np.asarray(sparse.indices)[:, 0]
+        tokens = self.lookup[np.asarray(sparse.values)]
+        counts = np.bincount(rows, minlength=batch_size)
+        return [''.join(row_tokens) for row_tokens in
+                np.split(tokens, np.cumsum(counts)[:-1])]
+
+    def decode_dense(self, dense):
+        """
+        Inputs:
+            dense: int array, [batch_size, label_pad], -1 -> sparse slots
+        Return:
+            texts: list of string
+        """
+        return [self.decode(row) for row in np.asarray(dense)]
+
+
+def get_vocabulary(lowercase_only=False):
+    if lowercase_only:
+        return Vocabulary(LOWERCASE_LETTER_TABLE, lowercase=True)
+    return Vocabulary(LETTER_TABLE)